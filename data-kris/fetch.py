@@ -16,8 +16,9 @@ from data import (
     states,
     load_scores,
     arr_from_scores,
-    load_aggregates,
+    load_aggregate_arrays,
     arr_from_aggregates,
+    ScoresIndex,
 )
 
 debug: bool = False  # Set to True to run the test code at the end of this file
@@ -51,7 +52,14 @@ def _extract_num_seats(districts_by_state):
 def _calc_d_vote_share(xx: str, chamber: str, ensemble: str) -> np.ndarray:
     """Calculate the two-party Democratic vote share"""
 
-    aggregates_subset = load_aggregates(xx, chamber, ensemble, "partisan", zip_dir)
+    aggregates_subset = load_aggregate_arrays(
+        xx,
+        chamber,
+        ensemble,
+        "partisan",
+        zip_dir,
+        ["dem_by_district", "tot_by_district"],
+    )
 
     arrays: List = list()
     for aggregate in ["dem_by_district", "tot_by_district"]:
@@ -140,7 +148,7 @@ state_list = states
 num_seats_dict = _extract_num_seats(DISTRICTS_BY_STATE)
 
 # Tally the Dem voteshare for each state
-scores_df: pd.DataFrame = load_scores(scores_path)
+scores_df: ScoresIndex = ScoresIndex(load_scores(scores_path))
 state_to_dem_voteshare = dict()
 for state in state_list:
     a = arr_from_scores(state, "congress", "A0", "estimated_vote_pct", scores_df)[0]
@@ -0,0 +1,472 @@
+"""
+SHARED SUPPORT FOR THE LONG-RUNNING BUILD SCRIPTS
+"""
+
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import socket
+import zipfile
+import argparse
+import resource
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from data.constants import states, chambers
+from data.codecs import decompress_stream
+
+
+class Checkpoint:
+    """
+    A record of the units -- (state, chamber, ensemble) combinations -- of a build that are done,
+    so a restarted build can skip them.
+
+    Each unit's output is saved as a part file in the checkpoint directory,
+    and its key is appended to checkpoint.jsonl once the part file is complete.
+
+    When several workers share the directory (see --shard and --queue), each appends
+    to its own checkpoint-{worker}.jsonl, and the units done by all of them are read.
+    """
+
+    def __init__(
+        self, directory: str, suffix: str, worker: Optional[str] = None
+    ) -> None:
+        self.directory: str = os.path.expanduser(directory)
+        self.suffix: str = suffix
+        self.path: str = os.path.join(
+            self.directory,
+            "checkpoint.jsonl" if worker is None else f"checkpoint-{worker}.jsonl",
+        )
+        self.done: Dict[str, str] = dict()
+
+        os.makedirs(self.directory, exist_ok=True)
+        for path in sorted(
+            glob.glob(os.path.join(self.directory, "checkpoint*.jsonl"))
+        ):
+            with open(path, "r") as checkpoint_file:
+                for line in checkpoint_file:
+                    try:
+                        record: Dict[str, str] = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # A partial line, from a crash
+                    if os.path.exists(record["part"]):
+                        self.done[record["unit"]] = record["part"]
+
+    def part_path(self, n: int) -> str:
+        """The path of the part file for the n-th unit."""
+
+        return os.path.join(self.directory, f"{n:04d}{self.suffix}")
+
+    def is_done(self, unit: str) -> bool:
+        return unit in self.done
+
+    def mark_done(self, unit: str, part: str) -> None:
+        """Record that a unit is done, once its part file is complete."""
+
+        with open(self.path, "a") as checkpoint_file:
+            checkpoint_file.write(json.dumps({"unit": unit, "part": part}) + "\n")
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        self.done[unit] = part
+
+    def clear(self) -> None:
+        """Remove the checkpoint and the part files, once the build is complete."""
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class WorkQueue:
+    """
+    A work queue of units shared by workers -- processes on one or more machines -- through a
+    directory on a shared filesystem. A worker claims a unit by creating its lock file, which
+    succeeds for just one of them.
+
+    The claims of a worker that dies are never released: the units it didn't finish are built
+    by the final merge run (see assigned_to_worker).
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory: str = os.path.join(os.path.expanduser(directory), "claims")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def claim(self, n: int) -> bool:
+        """Try to claim the n-th unit. Returns whether this worker got it."""
+
+        try:
+            fd: int = os.open(
+                os.path.join(self.directory, f"{n:04d}.lock"),
+                os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+            )
+        except FileExistsError:
+            return False
+
+        os.write(fd, f"{socket.gethostname()} {os.getpid()}\n".encode("utf-8"))
+        os.close(fd)
+
+        return True
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """Parse a --shard i/N argument: this worker builds every N-th unit, starting with the i-th (0 <= i < N)."""
+
+    i, _, n = shard.partition("/")
+    assert (
+        i.isdigit() and n.isdigit() and 0 <= int(i) < int(n)
+    ), f"Invalid shard {shard}: expected i/N with 0 <= i < N"
+
+    return int(i), int(n)
+
+
+def worker_name(shard: Optional[Tuple[int, int]], queue: bool) -> Optional[str]:
+    """A name for this worker's checkpoint file, if it is one of several."""
+
+    if shard is not None:
+        return f"shard-{shard[0]}-of-{shard[1]}"
+    if queue:
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    return None
+
+
+def assigned_to_worker(
+    n: int,
+    unit: str,
+    checkpoint: Checkpoint,
+    shard: Optional[Tuple[int, int]],
+    queue: Optional[WorkQueue],
+) -> bool:
+    """
+    Whether this worker should build the n-th unit: it isn't done, it is in this worker's shard,
+    and this worker claimed it from the queue. With neither a shard nor a queue -- i.e., for the
+    final merge run -- that is every unit that isn't done.
+    """
+
+    if checkpoint.is_done(unit):
+        return False
+    if shard is not None and n % shard[1] != shard[0]:
+        return False
+    if queue is not None and not queue.claim(n):
+        return False
+
+    return True
+
+
+### STATS ###
+
+phases: List[str] = ["open", "decompress", "parse", "merge", "write"]
+
+
+class UnitStats:
+    """The wall time of each phase of building a unit, and the bytes & rows in and out."""
+
+    def __init__(self, unit: str, source: str = "zips") -> None:
+        self.unit: str = unit
+        # Where the unit was read from: the zips, a checkpoint, ...
+        self.source: str = source
+        self.seconds: Dict[str, float] = {phase: 0.0 for phase in phases}
+        self.bytes_in: int = 0
+        self.bytes_out: int = 0
+        self.rows: int = 0
+        self._stack: List[str] = list()
+        self._clock: float = 0.0
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time a phase. Time in the same phase adds up. The time in a phase nested in another
+        -- e.g., decompressing while parsing a stream -- counts only toward the inner one.
+        """
+
+        self._switch()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._switch()
+            self._stack.pop()
+
+    def timed(self, stream: BinaryIO, name: str) -> BinaryIO:
+        """Wrap a stream so the time spent reading it -- e.g., decompressing it -- counts toward a phase."""
+
+        return _TimedReader(stream, self, name)  # type: ignore
+
+    def _switch(self) -> None:
+        """Credit the time since the last switch to the current phase, if any."""
+
+        now: float = time.perf_counter()
+        if self._stack:
+            self.seconds[self._stack[-1]] += now - self._clock
+        self._clock = now
+
+    def to_dict(self) -> Dict[str, Any]:
+        total: float = sum(self.seconds.values())
+
+        return {
+            "unit": self.unit,
+            "source": self.source,
+            "seconds": {phase: round(t, 6) for phase, t in self.seconds.items()},
+            "total_seconds": round(total, 6),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "rows": self.rows,
+            "rows_per_second": round(self.rows / total, 1) if total > 0 else None,
+        }
+
+
+class BuildStats:
+    """The stats for the units of a build, plus the totals and peak memory, for --stats."""
+
+    def __init__(self) -> None:
+        self.start: float = time.perf_counter()
+        self.units: List[UnitStats] = list()
+
+    def add(self, unit_stats: UnitStats) -> None:
+        self.units.append(unit_stats)
+
+    def summary(self) -> Dict[str, Any]:
+        """The totals over all the units, the wall time of the build, and the peak RSS of it & its worker processes."""
+
+        wall: float = time.perf_counter() - self.start
+        seconds: Dict[str, float] = {
+            phase: sum(u.seconds[phase] for u in self.units) for phase in phases
+        }
+        rows: int = sum(u.rows for u in self.units)
+
+        return {
+            "units": len(self.units),
+            "wall_seconds": round(wall, 6),
+            "seconds": {phase: round(t, 6) for phase, t in seconds.items()},
+            "bytes_in": sum(u.bytes_in for u in self.units),
+            "bytes_out": sum(u.bytes_out for u in self.units),
+            "rows": rows,
+            "rows_per_second": round(rows / wall, 1) if wall > 0 else None,
+            "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+            "peak_rss_children_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        }
+
+    def write(self, stats_path: str) -> None:
+        """Write the stats as JSON, and print the summary as a table."""
+
+        summary: Dict[str, Any] = self.summary()
+        with open(os.path.expanduser(stats_path), "w") as stats_file:
+            json.dump(
+                {"summary": summary, "units": [u.to_dict() for u in self.units]},
+                stats_file,
+                indent=1,
+            )
+
+        total: float = sum(summary["seconds"].values())
+        print()
+        print(f"{'Phase':<12}{'Seconds':>12}{'Share':>8}")
+        for phase, t in summary["seconds"].items():
+            share: float = t / total if total > 0 else 0.0
+            print(f"{phase:<12}{t:>12.2f}{share:>8.1%}")
+        print(f"{'total':<12}{total:>12.2f}")
+        print()
+        print(f"{summary['units']:,} units in {summary['wall_seconds']:.2f} s (wall)")
+        print(f"{summary['bytes_in']:,} bytes in, {summary['bytes_out']:,} bytes out")
+        print(
+            f"{summary['rows']:,} rows, {summary['rows_per_second'] or 0:,.0f} rows / s"
+        )
+        print(
+            f"Peak RSS {summary['peak_rss_mb']:,.0f} MB (worker processes: {summary['peak_rss_children_mb']:,.0f} MB)"
+        )
+        print(f"Stats written to {stats_path}")
+
+
+### ZIPS ###
+
+
+def rewrite_zip(
+    zip_path: str,
+    output_path: str,
+    suffix: str,
+    make_writer: Callable[[BinaryIO], Any],
+) -> Tuple[int, int, int]:
+    """
+    Rewrite a zip with its .xz files re-encoded, line by line, by the writers that make_writer makes
+    (see data/codecs.py), and renamed to end with the suffix. The other files are copied as is.
+    Returns the number of files re-encoded and their sizes before & after.
+    """
+
+    n_files: int = 0
+    n_bytes_in: int = 0
+    n_bytes_out: int = 0
+
+    with zipfile.ZipFile(zip_path) as zin, zipfile.ZipFile(
+        f"{output_path}.tmp", "w"
+    ) as zout:
+        for info in zin.infolist():
+            if not info.filename.endswith(".xz"):
+                with zin.open(info) as src, zout.open(
+                    _copy_info(info, info.filename, info.compress_type),
+                    "w",
+                    force_zip64=True,
+                ) as dst:
+                    shutil.copyfileobj(src, dst, 1 << 20)
+                continue
+
+            print(f"  Re-encoding {info.filename} ...")
+
+            # The re-encoded file is already compressed, so the zip stores it as is
+
+            out_info: zipfile.ZipInfo = _copy_info(
+                info, info.filename[: -len(".xz")] + suffix, zipfile.ZIP_STORED
+            )
+            with zin.open(info) as src, decompress_stream(
+                info.filename, src
+            ) as lines, zout.open(out_info, "w", force_zip64=True) as dst:
+                writer: Any = make_writer(dst)
+                for line in lines:
+                    writer.write(line)
+                writer.close()
+
+            n_files += 1
+            n_bytes_in += info.compress_size
+            n_bytes_out += zout.getinfo(out_info.filename).compress_size
+
+    os.replace(f"{output_path}.tmp", output_path)
+
+    return n_files, n_bytes_in, n_bytes_out
+
+
+def rewrite_zips(
+    verb: str,
+    verbed: str,
+    suffix: str,
+    add_codec_arguments: Callable[[ArgumentParser], None],
+    make_writer: Callable[[Namespace], Callable[[BinaryIO], Any]],
+) -> None:
+    """
+    The driver for the scripts that rewrite the 22 zips (e.g., repack_xz.py): parse the command line
+    arguments -- --input, --output, --jobs, and the codec's own, added by add_codec_arguments -- and
+    rewrite the zips in the input directory into the output directory (see rewrite_zip), --jobs at a time,
+    with the (picklable) writer maker that make_writer makes from the arguments.
+    The verb (e.g., "repack" & "repacked") is for the help & the messages.
+    """
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description="Parse command line arguments."
+    )
+
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="The directory containing the input .zip files",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help=f"The directory for the {verbed} .zip files",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help=f"The number of zips to {verb} in parallel",
+    )
+    add_codec_arguments(parser)
+
+    parser.add_argument("--debug", dest="debug", action="store_true", help="Debug mode")
+    parser.add_argument(
+        "-v", "--verbose", dest="verbose", action="store_true", help="Verbose mode"
+    )
+
+    args: Namespace = parser.parse_args()
+
+    input_dir: str = os.path.expanduser(args.input)
+    output_dir: str = os.path.expanduser(args.output)
+    assert os.path.abspath(input_dir) != os.path.abspath(
+        output_dir
+    ), "The output directory must be different from the input directory"
+    os.makedirs(output_dir, exist_ok=True)
+
+    writer: Callable[[BinaryIO], Any] = make_writer(args)
+    zip_names: List[str] = [
+        f"{xx}_{chamber}.zip" for xx in states for chamber in chambers
+    ] + ["reversible.long.zip"]
+    jobs: List[Tuple[str, str]] = [
+        (os.path.join(input_dir, zip_name), os.path.join(output_dir, zip_name))
+        for zip_name in zip_names
+        if os.path.exists(os.path.join(input_dir, zip_name))
+    ]
+
+    with ProcessPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        futures: List[Future] = [
+            pool.submit(rewrite_zip, zip_path, output_path, suffix, writer)
+            for zip_path, output_path in jobs
+        ]
+        for (zip_path, _), future in zip(jobs, futures):
+            n_files, n_bytes_in, n_bytes_out = future.result()
+            print(
+                f"{verbed.capitalize()} {n_files} files in {zip_path}: {n_bytes_in:,} bytes -> {n_bytes_out:,} bytes"
+            )
+
+
+def unit_key(xx: str, chamber: str, e_id: str) -> str:
+    """The key for a state, chamber, and ensemble."""
+
+    return f"{xx}/{chamber}/{e_id}"
+
+
+### HELPERS ###
+
+
+class _TimedReader:
+    """A stream whose reads count toward a phase of a unit's stats."""
+
+    def __init__(self, stream: BinaryIO, stats: UnitStats, name: str) -> None:
+        self.stream: BinaryIO = stream
+        self.stats: UnitStats = stats
+        self.name: str = name
+
+    def read(self, size: int = -1) -> bytes:
+        with self.stats.phase(self.name):
+            return self.stream.read(size)
+
+    def readline(self, size: int = -1) -> bytes:
+        with self.stats.phase(self.name):
+            return self.stream.readline(size)
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.readline, b"")
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
+    def __enter__(self) -> "_TimedReader":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stream.close()
+
+
+def _peak_rss_mb(who: int) -> float:
+    """The peak resident set size of this process (or of its terminated children), in MB."""
+
+    peak: int = resource.getrusage(who).ru_maxrss
+    scale: int = 1 if sys.platform == "darwin" else 1024  # Bytes on macOS, KB on Linux
+
+    return round(peak * scale / (1 << 20), 1)
+
+
+def _copy_info(info: zipfile.ZipInfo, name: str, compress_type: int) -> zipfile.ZipInfo:
+    """A new zip entry for a file, with the original's timestamp & permissions."""
+
+    copied: zipfile.ZipInfo = zipfile.ZipInfo(name, date_time=info.date_time)
+    copied.compress_type = compress_type
+    copied.external_attr = info.external_attr
+
+    return copied
+
+
+### END ###
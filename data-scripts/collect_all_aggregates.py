@@ -9,32 +9,50 @@ To use this script:
 
 (2) Run the script:
     ```
-    data/collect_aggregates.py \
+    PYTHONPATH=. data-scripts/collect_all_aggregates.py \
     --input /path/to/zip/directory \
     --output /path/to/aggregates.jsonl
     ```
 
+    Add --checkpoint /path/to/checkpoint/directory to be able to restart a failed run where it left off.
+    Add --stats /path/to/stats.json to record the time each ensemble takes in each phase of the run
+    (zip open, decompress, parse, merge, and write), the bytes & rows in and out, and the peak memory.
+
+    To split the run across several machines that share a filesystem, run a worker on each with
+    the same shared --checkpoint directory and either --shard i/N (the i-th of N workers, 0 <= i < N)
+    or --queue (the workers claim ensembles from a queue in the directory as they go). The workers
+    only collect their ensembles into part files. Then merge the parts by running the script once more
+    with the same --checkpoint directory and neither option; it also collects any ensembles a failed
+    worker left undone.
+
 (3) Zip the README.md together with the .jsonl file and upload it to the download server.
 
 NOTE - This is NOT a good solution: The file size is way too big (~40GB) making the access time very slow.
 """
 
-from typing import Dict, List, Set, Any
+from typing import Dict, List, Tuple, Any, Optional, TextIO
 
 import argparse
 from argparse import ArgumentParser, Namespace
 
 import os
-import json
-import zipfile
-import fnmatch
-import lzma
-import tempfile
 
 from rdapy import smart_write, write_record
 
-from constants import *
-from filenames import get_ensemble_name
+from data.constants import *
+from data.catalog import Catalog, ZipMember, load_catalog
+from data.codecs import Buffer, decompress, is_blank, iter_lines
+from data.decoding import loads
+from buildutils import (
+    BuildStats,
+    UnitStats,
+    Checkpoint,
+    WorkQueue,
+    parse_shard,
+    worker_name,
+    assigned_to_worker,
+    unit_key,
+)
 
 import numpy as np
 from rdapy import smart_read
@@ -44,123 +62,176 @@ def main() -> None:
     """Load all the by-district JSONL files into a single unified JSON file."""
 
     args = parse_arguments()
+    stats: BuildStats = BuildStats()
+
+    # The units of work are the state, chamber, and ensemble combinations:
+    # first those in the 21 xx_chamber zips, then those in the reversible.long zip.
+    # Their bydistrict files are found through the catalog of the zips (see data/catalog.py).
+
+    catalog: Catalog = load_catalog(args.input)
+
+    units: List[Tuple[str, str, str]] = list()
+    for zip_type in [
+        "xx_chamber",  # The 21 xx_chamber zips
+        "reversible.long",  # The reversible.long zip
+    ]:
+        for xx in states:
+            for chamber in chambers:
+                for e_id in ensembles:
+
+                    # Toggle between the two types of zips
+
+                    if zip_type == "xx_chamber" and e_id == "Rev":
+                        continue
+                    if zip_type == "reversible.long" and e_id != "Rev":
+                        continue
+
+                    units.append((xx, chamber, e_id))
+
+    # With --checkpoint, each unit is written to a part file as it is done,
+    # so a restarted build picks up where it left off. The parts are then
+    # concatenated, in order, into the output.
+    # With --shard or --queue, this is one of several workers that share the checkpoint directory,
+    # and it only writes the part files.
+
+    shard: Optional[Tuple[int, int]] = parse_shard(args.shard) if args.shard else None
+    is_worker: bool = shard is not None or args.queue
+    assert (
+        args.checkpoint or not is_worker
+    ), "--shard and --queue need a --checkpoint directory shared by the workers"
 
     i: int = 0
-    with smart_write(args.output) as aggregates_stream:
-        for zip_type in [
-            "xx_chamber",  # The 21 xx_chamber zips
-            "reversible.long",  # The reversible.long zip
-        ]:
-            bydistrict_files: Set[str] = set()  # Ensure each is processed only once
-
-            for xx in states:
-                for chamber in chambers:
-                    for e_id in ensembles:
-
-                        # Toggle between the two types of zips
-
-                        if zip_type == "xx_chamber" and e_id == "Rev":
-                            continue
-                        if zip_type == "reversible.long" and e_id != "Rev":
-                            continue
-
-                        zip_path: str
-                        if zip_type == "xx_chamber":
-                            zip_path = os.path.expanduser(
-                                f"{args.input}/{xx}_{chamber}.zip"
-                            )
-                        else:
-                            zip_path = os.path.expanduser(
-                                f"{args.input}/reversible.long.zip"
-                            )
-
-                        # Read the bydistrict JSONL files from the zips.
-                        # To keep this nested xx / chamber / e__id looping simple,
-                        # it cracks the same {xx}_{chamber} zip file repeatedly.
-
-                        with tempfile.TemporaryDirectory() as temp_dir:
-                            with zipfile.ZipFile(zip_path) as zf:
-
-                                # Get the by-district file names
-
-                                ensemble_name: str = get_ensemble_name(
-                                    xx, chamber, e_id
-                                )
-                                assert (
-                                    ensemble_name not in bydistrict_files
-                                ), f"Duplicate ensemble name {ensemble_name} found in {zip_path}"
-                                bydistrict_files.add(ensemble_name)
-
-                                aggregates_pattern: str = "*_bydistrict.jsonl"
-                                if e_id != "Rev":
-                                    aggregates_pattern = f"{xx}_{chamber}/{ensemble_name}/{xx}_{chamber}_{aggregates_pattern}.xz"
-                                else:
-                                    aggregates_pattern = f"reversible.long/{xx}/{xx}_{chamber}/{ensemble_name}/{xx}_{chamber}_{aggregates_pattern}"
-
-                                zipped_files: List[str] = zf.namelist()
-                                zipped_files = [
-                                    f
-                                    for f in zipped_files
-                                    if fnmatch.fnmatch(f, aggregates_pattern)
-                                ]
-                                assert (
-                                    len(zipped_files) == 5
-                                ), f"Expected 5 bydistrict files, found {len(zipped_files)}"
-
-                                # Read each file & collect the aggregates
-
-                                aggregate_pieces: List[Dict[str, Dict[str, Any]]] = (
-                                    list()
-                                )
-                                for j, aggs_file in enumerate(zipped_files):
-                                    agg_type = next(
-                                        (s for s in agg_types if s in aggs_file),
-                                        None,
-                                    )
-                                    assert (
-                                        agg_type is not None
-                                    ), f"Unknown aggregate type in {aggs_file}"
-                                    print(
-                                        f"  Loading {agg_type} aggregates: {aggs_file} ..."
-                                    )
-
-                                    if e_id != "Rev":
-                                        xz_data = zf.read(aggs_file)
-                                        agg_data = lzma.decompress(xz_data)
-                                    else:
-                                        agg_data = zf.read(aggs_file)
-
-                                    json_objects: List[Dict[str, Any]] = decode_bytes(
-                                        agg_data
-                                    )
-
-                                    agg_partial: Dict[str, Dict[str, Any]] = (
-                                        extract_aggregates(json_objects, agg_type)
-                                    )
-                                    aggregate_pieces.append(agg_partial)
-
-                                    i += 1
-
-                                # Merge the aggregates from all files
-
-                                aggs_for_plans: Dict[str, Dict[str, Any]] = (
-                                    merge_aggregates(aggregate_pieces)
-                                )
-
-                                # Write the combined aggregates to the output stream
-
-                                for name, aggs in aggs_for_plans.items():
-                                    record: Dict[str, Any] = {
-                                        "_tag_": "by-district",
-                                        "name": name,
-                                        "state": xx,
-                                        "chamber": chamber,
-                                        "ensemble": e_id,
-                                        "aggregates": aggs,
-                                    }
-                                    write_record(record, aggregates_stream)
-
-    print(f"Collected all {i} bydistrict files ...")  # s.b. 1,680
+    if not args.checkpoint:
+        with smart_write(args.output) as aggregates_stream:
+            for xx, chamber, e_id in units:
+                unit_stats: UnitStats = UnitStats(unit_key(xx, chamber, e_id))
+                i += collect_ensemble_aggregates(
+                    catalog, xx, chamber, e_id, aggregates_stream, unit_stats
+                )
+                stats.add(unit_stats)
+    else:
+        checkpoint: Checkpoint = Checkpoint(
+            args.checkpoint, ".jsonl", worker_name(shard, args.queue)
+        )
+        queue: Optional[WorkQueue] = WorkQueue(args.checkpoint) if args.queue else None
+        print(
+            f"Resuming {len(checkpoint.done)} ensembles from {checkpoint.directory} ..."
+        )
+
+        for n, (xx, chamber, e_id) in enumerate(units):
+            key: str = unit_key(xx, chamber, e_id)
+            if not assigned_to_worker(n, key, checkpoint, shard, queue):
+                continue
+
+            part: str = checkpoint.part_path(n)
+            unit_stats = UnitStats(key)
+            with open(f"{part}.tmp", "w") as part_stream:
+                i += collect_ensemble_aggregates(
+                    catalog, xx, chamber, e_id, part_stream, unit_stats
+                )
+            os.replace(f"{part}.tmp", part)
+            checkpoint.mark_done(key, part)
+            stats.add(unit_stats)
+
+        if is_worker:
+            print(f"Collected {i} bydistrict files into {checkpoint.directory} ...")
+            if args.stats:
+                stats.write(args.stats)
+            return
+
+        print(f"Concatenating the {len(units)} ensembles into {args.output} ...")
+        with smart_write(args.output) as aggregates_stream:
+            for xx, chamber, e_id in units:
+                with open(
+                    checkpoint.done[unit_key(xx, chamber, e_id)], "r"
+                ) as part_stream:
+                    for line in part_stream:
+                        aggregates_stream.write(line)
+
+        checkpoint.clear()
+
+    print(f"Collected all {i} bydistrict files ...")  # s.b. 1,680 for a full build
+
+    if args.stats:
+        stats.write(args.stats)
+
+
+def collect_ensemble_aggregates(
+    catalog: Catalog,
+    xx: str,
+    chamber: str,
+    e_id: str,
+    aggregates_stream: TextIO,
+    unit_stats: UnitStats,
+) -> int:
+    """
+    Collect the by-district aggregates for an ensemble from its 5 bydistrict files,
+    and write a record per plan to the output stream. Returns the number of files read.
+    Records the time in each phase in the stats.
+    """
+
+    # Get the by-district files
+
+    with unit_stats.phase("open"):
+        zipped_files: List[ZipMember] = catalog.members_for(
+            xx, chamber, e_id, "bydistrict"
+        )
+    assert (
+        len(zipped_files) == 5
+    ), f"Expected 5 bydistrict files, found {len(zipped_files)}"
+
+    # Read each file & collect the aggregates
+
+    aggregate_pieces: List[Dict[str, Dict[str, Any]]] = list()
+    for aggs_file in zipped_files:
+        agg_type = next(
+            (s for s in agg_types if s in aggs_file.name),
+            None,
+        )
+        assert agg_type is not None, f"Unknown aggregate type in {aggs_file.name}"
+        print(f"  Loading {agg_type} aggregates: {aggs_file.name} ...")
+
+        unit_stats.bytes_in += aggs_file.compress_size
+
+        with unit_stats.phase("open"):
+            zipped_data: Buffer = catalog.buffer(aggs_file)
+        with unit_stats.phase("decompress"):
+            agg_data: Buffer = decompress(aggs_file.name, zipped_data)
+        with unit_stats.phase("parse"):
+            json_objects: List[Dict[str, Any]] = decode_bytes(agg_data)
+
+        with unit_stats.phase("merge"):
+            agg_partial: Dict[str, Dict[str, Any]] = extract_aggregates(
+                json_objects, agg_type
+            )
+        aggregate_pieces.append(agg_partial)
+
+    # Merge the aggregates from all files
+
+    with unit_stats.phase("merge"):
+        aggs_for_plans: Dict[str, Dict[str, Any]] = merge_aggregates(aggregate_pieces)
+
+    # Write the combined aggregates to the output stream
+
+    with unit_stats.phase("write"):
+        start: Optional[int] = _position(aggregates_stream)
+        for name, aggs in aggs_for_plans.items():
+            record: Dict[str, Any] = {
+                "_tag_": "by-district",
+                "name": name,
+                "state": xx,
+                "chamber": chamber,
+                "ensemble": e_id,
+                "aggregates": aggs,
+            }
+            write_record(record, aggregates_stream)
+        stop: Optional[int] = _position(aggregates_stream)
+
+    if start is not None and stop is not None:
+        unit_stats.bytes_out += stop - start
+    unit_stats.rows += len(aggs_for_plans)
+
+    return len(zipped_files)
 
 
 def arr_from_aggregates(
@@ -189,7 +260,7 @@ def arr_from_aggregates(
 
     with smart_read(os.path.expanduser(file_path)) as input_stream:
         for i, line in enumerate(input_stream):
-            r: Dict[str, Any] = json.loads(line)
+            r: Dict[str, Any] = loads(line)
 
             if (
                 r["state"] == xx
@@ -225,12 +296,10 @@ datasets_by_type: Dict[str, List[str]] = {
 }
 
 
-def decode_bytes(bytes: bytes) -> List[Dict[str, Any]]:
-    """Decode the bytes from a zipped by-district JSONL file."""
+def decode_bytes(data: Buffer) -> List[Dict[str, Any]]:
+    """Decode the bytes (or a view of them) from a zipped by-district JSONL file."""
 
-    json_objects = [
-        json.loads(line) for line in bytes.decode("utf-8").strip().split("\n") if line
-    ]
+    json_objects = [loads(line) for line in iter_lines(data) if not is_blank(line)]
 
     return json_objects
 
@@ -284,6 +353,15 @@ def merge_aggregates(
     return merged
 
 
+def _position(stream: TextIO) -> Optional[int]:
+    """The position in an output stream, if it can tell (e.g., not if it is compressed on the fly)."""
+
+    try:
+        return stream.tell()
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
 def parse_arguments():
     """Parse command line arguments."""
 
@@ -304,6 +382,29 @@ def parse_arguments():
         help="The path to the output .parquet file",
     )
 
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        help="A directory for checkpointing the run, so a restarted run skips the ensembles already done",
+    )
+
+    parser.add_argument(
+        "--stats",
+        type=str,
+        help="The path to a .json file for the time in each phase of the run, the throughput, and the peak memory",
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        help="As the i-th of N workers (i/N, 0 <= i < N), only collect every N-th ensemble into the --checkpoint directory",
+    )
+    parser.add_argument(
+        "--queue",
+        dest="queue",
+        action="store_true",
+        help="As one of several workers, claim ensembles from a queue in the --checkpoint directory and only collect those",
+    )
+
     parser.add_argument("--debug", dest="debug", action="store_true", help="Debug mode")
     parser.add_argument(
         "-v", "--verbose", dest="verbose", action="store_true", help="Verbose mode"
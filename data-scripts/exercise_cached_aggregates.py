@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""
+TEST HARNESS TO CHECK THE AGGREGATE RECORDS & THE CACHE AGAINST THE AGGREGATE ARRAYS
+
+For each ensemble and aggregate category, the records (load_aggregates, for VAP & CVAP for minority)
+must give the same arrays as load_aggregate_arrays, and the cache (see data/cache.py) must give back
+exactly the same records & arrays, when it misses & when it hits.
+"""
+
+from typing import Any, Dict, List
+
+import numpy as np
+import json
+import tempfile
+
+from data import (
+    states,
+    chambers,
+    ensembles,
+    aggregates_by_category,
+    load_aggregates,
+    load_aggregate_arrays,
+    arr_from_aggregates,
+    enable_cache,
+    disable_cache,
+)
+
+
+##########
+
+zip_dir: str = "~/local/beta-ensembles/zipped"
+
+##########
+
+print()
+print("Checking the aggregate records & the cache:")
+
+with tempfile.TemporaryDirectory() as cache_dir:
+    for xx in states:
+        for chamber in chambers:
+            for ensemble in ensembles:
+                for category, aggs in aggregates_by_category.items():
+                    print(
+                        f"  Checking the {category} aggregates for {xx}, {chamber}, {ensemble} ..."
+                    )
+                    minority_datasets: List[str] = (
+                        ["vap", "cvap"] if category == "minority" else ["vap"]
+                    )
+
+                    disable_cache()
+                    arrays: Dict[str, np.ndarray] = load_aggregate_arrays(
+                        xx, chamber, ensemble, category, zip_dir
+                    )
+                    records: Dict[str, List[Dict[str, Any]]] = {
+                        minority_dataset: load_aggregates(
+                            xx,
+                            chamber,
+                            ensemble,
+                            category,
+                            zip_dir,
+                            minority_dataset=minority_dataset,
+                        )
+                        for minority_dataset in minority_datasets
+                    }
+
+                    for agg in aggs:
+                        dataset: str = (
+                            agg.rsplit("_", 1)[1] if category == "minority" else "vap"
+                        )
+                        assert np.array_equal(
+                            arr_from_aggregates(agg, records[dataset]),
+                            arr_from_aggregates(agg, arrays),
+                        ), f"Arrays differ from records for {xx}, {chamber}, {ensemble}, {agg}"
+
+                    enable_cache(cache_dir)
+                    for _ in range(2):
+                        for minority_dataset in minority_datasets:
+                            cached: List[Dict[str, Any]] = load_aggregates(
+                                xx,
+                                chamber,
+                                ensemble,
+                                category,
+                                zip_dir,
+                                minority_dataset=minority_dataset,
+                            )
+                            # Through JSON, so the types & the order of the keys count too
+                            assert json.dumps(cached) == json.dumps(
+                                records[minority_dataset]
+                            ), f"Cached records differ for {xx}, {chamber}, {ensemble}, {category}"
+
+                        cached_arrays: Dict[str, np.ndarray] = load_aggregate_arrays(
+                            xx, chamber, ensemble, category, zip_dir
+                        )
+                        for key, arr in arrays.items():
+                            assert cached_arrays[
+                                key
+                            ].dtype == arr.dtype and np.array_equal(
+                                cached_arrays[key], arr
+                            ), f"Cached arrays differ for {xx}, {chamber}, {ensemble}, {key}"
+                    disable_cache()
+
+print("The records & the cache match the arrays.")
+
+pass
+
+### END ###
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
 """
-TEST HARNESS TO EXERCISE LOADING & FETCHING SCORES
+TEST HARNESS TO VALIDATE THE SCORES
+
+Exits with a non-zero status if any state, chamber, and ensemble combination
+is missing plans or has a metric that is all NaN.
 """
 
-import numpy as np
+import sys
 import pandas as pd
 
-from data import states, chambers, ensembles, metrics, load_scores, arr_from_scores
+from data import metrics, load_scores, validate_scores
 
 
 ##########
@@ -22,22 +25,22 @@ print()
 print("Loading scores from:", scores_path)
 scores_df: pd.DataFrame = load_scores(scores_path)
 
-print("Exercising scores DataFrame:")
-for xx in states:
-    for chamber in chambers:
-        for ensemble in ensembles:
-            for i, metric in enumerate(metrics):
-                print(
-                    f"  Fetching scores array for {xx}, {chamber}, {ensemble}: {metric} ..."
-                )
-                arr: np.ndarray = arr_from_scores(
-                    xx, chamber, ensemble, metric, scores_df
-                )
-                assert (
-                    arr.size > 0
-                ), f"Empty array for {xx}, {chamber}, {ensemble}, {metric}"
-
-print("All scores loaded successfully.")
+print("Validating scores DataFrame:")
+report: pd.DataFrame = validate_scores(scores_df)
+
+failed: pd.DataFrame = report[~report["ok"]]
+for (xx, chamber, ensemble), row in failed.iterrows():
+    all_nan = [m for m in metrics if row["plans"] > 0 and row[m] == row["plans"]]
+    print(
+        f"  {xx}, {chamber}, {ensemble}: {row['plans']:,} of {row['expected']:,} plans"
+        + (f", all NaN: {', '.join(all_nan)}" if all_nan else "")
+    )
+
+if len(failed) > 0:
+    print(f"{len(failed)} of {len(report)} combinations failed validation.")
+    sys.exit(1)
+
+print(f"All scores validated successfully ({report['plans'].sum():,} plans).")
 
 pass
 
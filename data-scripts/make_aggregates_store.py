@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""
+CONVERT THE BY-DISTRICT AGGREGATES IN THE ZIPS INTO A MEMORY-MAPPED COLUMNAR STORE
+
+Loading the aggregates from the zips (load_aggregates) decompresses & parses a whole JSONL file
+every time, and the integrated JSONL from collect_all_aggregates.py is too big to be usable.
+This script converts them once into a directory of .npy files, one 2D plans x districts array
+per state, chamber, ensemble, and aggregate, which load_stored_aggregates memory maps.
+See data/aggstore.py.
+
+To use this script:
+
+(1) Put all 22 zip files in a directory (7 x 3 = 21 xx_chamber zips + 1 reversible.long zip).
+
+(2) Run the script from the root of the repository:
+    ```
+    PYTHONPATH=. data-scripts/make_aggregates_store.py \
+    --input /path/to/zip/directory \
+    --output /path/to/aggregates/store
+    ```
+
+    Add --jobs N to convert N ensembles at a time.
+
+(3) Then load the aggregates from the store, e.g.:
+    ```
+    partisan = load_stored_aggregates("NC", "congress", "A0", "partisan", "/path/to/aggregates/store")
+    dem = arr_from_aggregates("dem_by_district", partisan)
+    ```
+
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import argparse
+from argparse import ArgumentParser, Namespace
+
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+from data.constants import *
+from data.catalog import Catalog, load_catalog
+from data.helpers import load_aggregate_arrays
+from data.aggstore import write_stored_aggregates, write_aggregates_store_index
+
+
+def main() -> None:
+    """Convert the by-district aggregates in the zips into an aggregates store."""
+
+    args = parse_arguments()
+
+    input_dir: str = os.path.expanduser(args.input)
+    output_dir: str = os.path.expanduser(args.output)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # The units of work are the state, chamber, and ensemble combinations with bydistrict files
+
+    catalog: Catalog = load_catalog(input_dir)
+    units: List[Tuple[str, str, str]] = [
+        (xx, chamber, e_id)
+        for xx in states
+        for chamber in chambers
+        for e_id in ensembles
+        if catalog.members_for(xx, chamber, e_id, "bydistrict")
+    ]
+
+    entries: Dict[Tuple[str, str, str], Dict[str, Any]] = dict()
+    with ProcessPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        futures: List[Future] = [
+            pool.submit(convert_ensemble_aggregates, input_dir, output_dir, *unit)
+            for unit in units
+        ]
+        for unit, future in zip(units, futures):
+            entries[unit] = future.result()
+            print(
+                f"Stored {len(entries[unit]['aggregates'])} aggregates for {entries[unit]['plans']} plans in {', '.join(unit)}"
+            )
+
+    write_aggregates_store_index(output_dir, entries)
+
+    print(
+        f"Converted the aggregates for {len(entries)} ensembles into {output_dir} ..."
+    )
+
+    pass
+
+
+def convert_ensemble_aggregates(
+    input_dir: str, output_dir: str, xx: str, chamber: str, e_id: str
+) -> Dict[str, Any]:
+    """
+    Load the aggregates in each category for an ensemble, and write them to the store
+    as 2D plans x districts arrays, with the statewide values in column 0.
+    Returns the ensemble's entry in the index of the store.
+    """
+
+    names: List[str] = list()
+    arrays: Dict[str, np.ndarray] = dict()
+
+    for category in aggregate_categories:
+        # For minority, extract both the VAP & CVAP aggregates in one pass
+        loaded: Dict[str, np.ndarray] = load_aggregate_arrays(
+            xx, chamber, e_id, category, input_dir
+        )
+
+        # Put the rows in the same plan order for every aggregate
+
+        if not names:
+            names = list(loaded["name"])
+        rows: Optional[np.ndarray] = None
+        if list(loaded["name"]) != names:
+            row_by_name: Dict[str, int] = {
+                name: i for i, name in enumerate(loaded["name"])
+            }
+            assert len(row_by_name) == len(names) and all(
+                name in row_by_name for name in names
+            ), f"The {category} aggregates for {xx}, {chamber}, {e_id} are for different plans"
+            rows = np.array([row_by_name[name] for name in names])
+
+        for aggregate in aggregates_by_category[category]:
+            arrays[aggregate] = (
+                loaded[aggregate] if rows is None else loaded[aggregate][rows]
+            )
+
+    return write_stored_aggregates(output_dir, xx, chamber, e_id, names, arrays)
+
+
+### HELPERS ###
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description="Parse command line arguments."
+    )
+
+    parser.add_argument(
+        "--input",
+        type=str,
+        required=True,
+        help="The directory containing the input .zip files",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help="The directory for the aggregates store",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="The number of ensembles to convert in parallel",
+    )
+
+    parser.add_argument("--debug", dest="debug", action="store_true", help="Debug mode")
+    parser.add_argument(
+        "-v", "--verbose", dest="verbose", action="store_true", help="Verbose mode"
+    )
+
+    args: Namespace = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    main()
+
+### END ###
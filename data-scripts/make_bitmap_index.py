@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+MAKE A BINNED BITMAP INDEX FOR A SCORES .PARQUET FILE
+
+To use this script, run it from the root of the repository:
+    ```
+    PYTHONPATH=. data-scripts/make_bitmap_index.py \
+    --scores /path/to/scores.parquet
+    ```
+
+The index is written next to the scores, e.g., /path/to/scores.bitmaps.npz.
+Query it with data.load_bitmap_index(bitmap_index_path(scores_path)).query(...).
+"""
+
+import argparse
+from argparse import ArgumentParser, Namespace
+
+from data.indexes import LazyScores
+from data.bitmaps import BitmapIndex, build_bitmap_index, bitmap_index_path
+
+
+def main() -> None:
+    """Build a bitmap index over all the metrics in the scores and save it next to them."""
+
+    args = parse_arguments()
+
+    print(f"Indexing {args.scores} ...")
+    scores: LazyScores = LazyScores(args.scores)
+    index: BitmapIndex = build_bitmap_index(scores, bins=args.bins)
+
+    index_path: str = args.output if args.output else bitmap_index_path(args.scores)
+    print(f"Saving bitmap index to {index_path} ...")
+    index.save(index_path)
+
+    pass
+
+
+def parse_arguments():
+    """Parse command line arguments."""
+
+    parser: ArgumentParser = argparse.ArgumentParser(
+        description="Parse command line arguments."
+    )
+
+    parser.add_argument(
+        "--scores",
+        type=str,
+        required=True,
+        help="The path to the scores .parquet file",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="The path to the output .npz file (default: next to the scores)",
+    )
+    parser.add_argument(
+        "--bins",
+        type=int,
+        default=16,
+        help="The maximum number of bins per metric",
+    )
+
+    parser.add_argument(
+        "-v", "--verbose", dest="verbose", action="store_true", help="Verbose mode"
+    )
+
+    args: Namespace = parser.parse_args()
+
+    return args
+
+
+if __name__ == "__main__":
+    main()
+
+### END ###
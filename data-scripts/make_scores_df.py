@@ -11,145 +11,528 @@ To use this script:
     `pip install pandas`
     `pip install pyarrow`
 
-(3) Run the script:
+(3) Run the script from the root of the repository:
     ```
-    data/make_scores_df.py \
+    PYTHONPATH=. data-scripts/make_scores_df.py \
     --input /path/to/zip/directory \
     --output /path/to/scores.parquet
     ```
 
+    Add --jobs N to read the zips with N processes.
+    Add --incremental to only re-read the ensembles whose scores files changed since the last build.
+    Add --checkpoint /path/to/checkpoint/directory to be able to restart a failed build where it left off.
+    Add --stats /path/to/stats.json to record the time each ensemble takes in each phase of the build
+    (zip open, decompress, parse, merge, and write), the bytes & rows in and out, and the peak memory.
+    Add --compact to store the scores with compact dtypes (see data.helpers.compact_scores),
+    and --float32 to also store the real-valued metrics as float32.
+
+    To split the build across several machines that share a filesystem, run a worker on each with
+    the same shared --checkpoint directory and either --shard i/N (the i-th of N workers, 0 <= i < N)
+    or --queue (the workers claim ensembles from a queue in the directory as they go). The workers
+    only build their ensembles into part files. Then merge the parts by running the script once more
+    with the same --checkpoint directory and neither option; it also builds any ensembles a failed
+    worker left undone.
+
 (4) Zip the README.md together with the .parquet file and upload it to the download server.
 
+The scores are sorted by state, chamber, and ensemble (in the order of the constants) and then by plan,
+and each state, chamber, and ensemble combination is written as its own row group. That lets
+load_scores() push state, chamber, and ensemble filters down to pyarrow and skip the other row groups.
+
+The scores CSVs are parsed straight from the decompressed streams, and each merged ensemble is
+written to the .parquet file as soon as it is ready, so peak memory is bounded by a few ensembles.
+The plan ids are stored as int64; the count metrics (see data.constants.count_metrics) as int64, if they
+are all whole numbers, as they were before the scores were streamed; and the other metrics as float64.
+With --compact, they are stored with compact dtypes instead.
+
+Next to the .parquet file, a manifest (scores.parquet.manifest.json) records the name, CRC32, and size
+of the scores files for each ensemble, from the zips' central directories. With --incremental,
+the ensembles whose entries haven't changed are copied from the existing .parquet file.
+
 """
 
-from typing import List, Set
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import argparse
 from argparse import ArgumentParser, Namespace
 
 import os
-import zipfile
-import fnmatch
-import lzma
-import tempfile
+import json
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-from pathlib import Path
-
-from constants import *
-from filenames import get_ensemble_name
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from data.constants import *
+from data.catalog import Catalog, ZipMember, load_catalog
+from data.codecs import decompress_stream
+from data.helpers import compact_scores, _count_type
+from data.indexes import _row_group_keys
+
+from buildutils import (
+    BuildStats,
+    UnitStats,
+    Checkpoint,
+    WorkQueue,
+    parse_shard,
+    worker_name,
+    assigned_to_worker,
+    unit_key,
+)
+
+Unit = Tuple[str, str, str, str, Optional[str], List[int], Optional[str], bool]
 
 
 def main() -> None:
-    """Load all the scores CSV files into a single unified pandas dataframe."""
+    """Stream all the scores CSV files into a single unified .parquet file."""
 
     args = parse_arguments()
+    stats: BuildStats = BuildStats()
+
+    # The units of work are the state, chamber, and ensemble combinations, in sorted order.
+    # Their scores files are found through the catalog of the zips (see data/catalog.py).
+    # With --jobs N, they are read in parallel, and each process opens each zip just once.
+    # With --incremental, the units whose scores files haven't changed since the last build
+    # (per the manifest) are copied from the existing .parquet file instead of being re-read.
+
+    output: str = os.path.expanduser(args.output)
+    manifest_path: str = f"{output}.manifest.json"
+    manifest: Dict[str, List[Dict[str, Any]]] = source_manifest(args.input)
+
+    previous: Dict[str, List[int]] = dict()
+    if args.incremental:
+        previous = reusable_units(output, manifest_path, manifest)
+        print(f"Reusing {len(previous)} of {len(manifest)} ensembles from {output} ...")
+
+    # With --checkpoint, each unit is also saved to a part file as it is done,
+    # so a restarted build picks up where it left off.
+    # With --shard or --queue, this is one of several workers that share the checkpoint directory.
+
+    shard: Optional[Tuple[int, int]] = parse_shard(args.shard) if args.shard else None
+    if shard is not None or args.queue:
+        assert (
+            args.checkpoint
+        ), "--shard and --queue need a --checkpoint directory shared by the workers"
+
+    checkpoint: Optional[Checkpoint] = (
+        Checkpoint(args.checkpoint, ".parquet", worker_name(shard, args.queue))
+        if args.checkpoint
+        else None
+    )
+
+    units: List[Unit] = list()
+    for xx in states:
+        for chamber in chambers:
+            for e_id in ensembles:
+                key: str = unit_key(xx, chamber, e_id)
+                row_groups: List[int] = previous.get(key, [])
+                part: Optional[str] = (
+                    checkpoint.part_path(len(units)) if checkpoint else None
+                )
+                resume: bool = checkpoint is not None and checkpoint.is_done(key)
+                units.append(
+                    (
+                        args.input,
+                        xx,
+                        chamber,
+                        e_id,
+                        output if row_groups else None,
+                        row_groups,
+                        part,
+                        resume,
+                    )
+                )
+    if checkpoint:
+        print(
+            f"Resuming {len(checkpoint.done)} ensembles from {checkpoint.directory} ..."
+        )
+
+    if shard is not None or args.queue:
+        assert checkpoint is not None
+        queue: Optional[WorkQueue] = WorkQueue(args.checkpoint) if args.queue else None
+        build_parts(units, checkpoint, shard, queue, args.jobs, stats)
+        if args.stats:
+            stats.write(args.stats)
+        return
+
+    # Write to a temporary file, and replace the output at the end
+
+    scores_path: str = f"{output}.tmp"
 
     i: int = 0
-    all_scores = []
-
-    for zip_type in [
-        "xx_chamber",  # The 21 xx_chamber zips
-        "reversible.long",  # The reversible.long zip
-    ]:
-        scores_files: Set[str] = set()
-        for xx in states:
-            for chamber in chambers:
-                for e_id in ensembles:
-
-                    # Toggle between the two types of zips
-
-                    if zip_type == "xx_chamber" and e_id == "Rev":
-                        continue
-                    if zip_type == "reversible.long" and e_id != "Rev":
-                        continue
-
-                    zip_path: str
-                    if zip_type == "xx_chamber":
-                        zip_path = os.path.expanduser(
-                            f"{args.input}/{xx}_{chamber}.zip"
-                        )
-                    else:
-                        zip_path = os.path.expanduser(
-                            f"{args.input}/reversible.long.zip"
-                        )
-
-                    # Read the scores CSVs from the zip files.
-                    # To keep this nested xx / chamber / e__id looping simple,
-                    # it cracks the same {xx}_{chamber} zip file repeatedly.
-
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        with zipfile.ZipFile(zip_path) as zf:
-
-                            # Get the by-district file names
-
-                            ensemble_name: str = get_ensemble_name(xx, chamber, e_id)
-                            assert (
-                                ensemble_name not in scores_files
-                            ), f"Duplicate ensemble name {ensemble_name} found in {zip_path}"
-                            scores_files.add(ensemble_name)
-
-                            scores_pattern: str = "*_scores.csv"
-                            if e_id != "Rev":
-                                scores_pattern = f"{xx}_{chamber}/{ensemble_name}/{xx}_{chamber}_{scores_pattern}.xz"
-                            else:
-                                scores_pattern = f"reversible.long/{xx}/{xx}_{chamber}/{ensemble_name}/{xx}_{chamber}_{scores_pattern}"
-
-                            zipped_files: List[str] = zf.namelist()
-                            zipped_files = [
-                                f
-                                for f in zipped_files
-                                if fnmatch.fnmatch(f, scores_pattern)
-                            ]
-                            assert (
-                                len(zipped_files) == 6
-                            ), f"Expected 6 scores files, found {len(zipped_files)}"
-
-                            # Read each file & collect the scores
-
-                            category_dfs = []
-                            for scores_file in zipped_files:
-                                print(f"      Loading {scores_file} ...")
-
-                                csv_filename: str
-                                if e_id != "Rev":
-                                    csv_filename = Path(scores_file).stem
-                                    xz_data = zf.read(scores_file)
-                                    csv_data = lzma.decompress(xz_data)
-                                else:
-                                    csv_filename = Path(scores_file).name
-                                    csv_data = zf.read(scores_file)
-
-                                csv_path = Path(temp_dir) / csv_filename
-                                with open(csv_path, "wb") as csv_file:
-                                    csv_file.write(csv_data)
-
-                                df = pd.read_csv(csv_path)
-                                category_dfs.append(df)
-                                i += 1
-
-                            combined_df = category_dfs[0]
-                            for df in category_dfs[1:]:
-                                combined_df = combined_df.merge(
-                                    df, on="map", how="outer"
-                                )
-
-                            combined_df["state"] = xx
-                            combined_df["chamber"] = chamber
-                            combined_df["ensemble"] = e_id
-
-                            all_scores.append(combined_df)
-
-    print(f"Concatenating all {i} scores files ...")  # s.b. 2,106
-    unified_df = pd.concat(all_scores, ignore_index=True)
-
-    print(f"Saving unified dataframe to {args.output} ...")
-    unified_df.to_parquet(args.output)
+    n_rows: int = 0
+    columns: Optional[List[str]] = None
+    count_types: Dict[str, Any] = dict()
+    not_counts: Any = np.float32 if args.float32 else np.float64
+    writer: Optional[pq.ParquetWriter] = None
+    sink: pa.OSFile = pa.OSFile(scores_path, "wb")
+
+    for unit, (combined_df, n_files, unit_stats) in map_units(
+        build_unit, units, args.jobs
+    ):
+        _, xx, chamber, e_id, _, _, part, resume = unit
+        if checkpoint and not resume:
+            checkpoint.mark_done(unit_key(xx, chamber, e_id), part)  # type: ignore
+
+        with unit_stats.phase("write"):
+            if columns is None:
+                columns = list(combined_df.columns)
+            combined_df = normalize_scores(combined_df, columns)
+
+            table: pa.Table = pa.Table.from_pandas(combined_df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(sink, table.schema)
+            written: int = sink.tell()
+            writer.write_table(table, row_group_size=max(len(combined_df), 1))
+            unit_stats.bytes_out += sink.tell() - written
+        stats.add(unit_stats)
+
+        for metric in [m for m in count_metrics if m in columns]:
+            count_types[metric] = _merge_types(
+                count_types.get(metric),
+                _count_type(combined_df[metric].to_numpy(), not_counts),
+                not_counts,
+            )
+
+        i += n_files
+        n_rows += len(combined_df)
+
+    assert writer is not None, "No scores found"
+    writer.close()
+    sink.close()
+    print(f"Read all {i} scores files ...")  # s.b. 2,106 for a full build
+
+    if args.compact:
+        print(f"Compacting the scores to {output} ...")
+        compact_parquet(
+            scores_path, f"{scores_path}.compact", count_types, args.float32
+        )
+        os.replace(f"{scores_path}.compact", scores_path)
+    else:
+        # The count metrics that are all whole numbers go back to int64, as before the scores were streamed
+        int_counts: List[str] = [
+            metric
+            for metric, count_type in count_types.items()
+            if np.issubdtype(count_type, np.integer)
+        ]
+        if int_counts:
+            int_counts_parquet(scores_path, f"{scores_path}.counts", int_counts)
+            os.replace(f"{scores_path}.counts", scores_path)
+    os.replace(scores_path, output)
+
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+
+    if checkpoint:
+        checkpoint.clear()
+
+    assert columns is not None
+    print(f"The integrated dataframe has {n_rows:,} rows and {len(columns)} columns")
+
+    if args.stats:
+        stats.write(args.stats)
+
+    pass
+
+
+def build_parts(
+    units: List[Unit],
+    checkpoint: Checkpoint,
+    shard: Optional[Tuple[int, int]],
+    queue: Optional[WorkQueue],
+    jobs: int,
+    stats: BuildStats,
+) -> None:
+    """As one of several workers, build this worker's units into part files in the shared checkpoint directory."""
+
+    assigned: Iterator[Unit] = (
+        unit
+        for n, unit in enumerate(units)
+        if assigned_to_worker(n, unit_key(*unit[1:4]), checkpoint, shard, queue)
+    )
+
+    i: int = 0
+    n_units: int = 0
+    for unit, (_, n_files, unit_stats) in map_units(build_unit, assigned, jobs):
+        checkpoint.mark_done(unit_key(*unit[1:4]), unit[6])  # type: ignore
+        stats.add(unit_stats)
+        i += n_files
+        n_units += 1
 
     print(
-        f"The integrated dataframe has {len(unified_df):,} rows and {len(unified_df.columns)} columns"
+        f"Built {n_units} ensembles from {i} scores files into {checkpoint.directory} ..."
     )
 
-    pass
+
+def source_manifest(input_dir: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    List the name, CRC32, and size of the scores files for each state, chamber, and ensemble,
+    from the catalog of the zips (nothing is decompressed).
+    """
+
+    catalog: Catalog = load_catalog(input_dir)
+
+    manifest: Dict[str, List[Dict[str, Any]]] = dict()
+    for xx in states:
+        for chamber in chambers:
+            for e_id in ensembles:
+                manifest[unit_key(xx, chamber, e_id)] = [
+                    {"name": member.name, "crc": member.crc, "size": member.file_size}
+                    for member in scores_members(catalog, xx, chamber, e_id)
+                ]
+
+    return manifest
+
+
+def reusable_units(
+    output: str, manifest_path: str, manifest: Dict[str, List[Dict[str, Any]]]
+) -> Dict[str, List[int]]:
+    """
+    Find the units whose scores files are unchanged since the existing .parquet file was built,
+    and the row groups they are in.
+    """
+
+    if not os.path.exists(output) or not os.path.exists(manifest_path):
+        return dict()
+
+    with open(manifest_path, "r") as manifest_file:
+        built: Dict[str, List[Dict[str, Any]]] = json.load(manifest_file)
+
+    row_group_keys: Optional[List[Tuple[str, str, str]]] = _row_group_keys(
+        pq.ParquetFile(output)
+    )
+    if row_group_keys is None:
+        print(
+            f"The row groups in {output} aren't one per ensemble, so it can't be reused."
+        )
+        return dict()
+
+    row_groups: Dict[str, List[int]] = dict()
+    for i, key in enumerate(row_group_keys):
+        row_groups.setdefault(unit_key(*key), []).append(i)
+
+    reusable: Dict[str, List[int]] = {
+        key: groups
+        for key, groups in row_groups.items()
+        if key in manifest and built.get(key) == manifest[key]
+    }
+
+    return reusable
+
+
+def build_unit(
+    input_dir: str,
+    xx: str,
+    chamber: str,
+    e_id: str,
+    previous_path: Optional[str],
+    row_groups: List[int],
+    part: Optional[str],
+    resume: bool,
+) -> Tuple[pd.DataFrame, int, UnitStats]:
+    """
+    Read the scores for an ensemble: from its checkpoint part file, if it was done before a restart;
+    from the row groups of the previous build, if they are unchanged; or else from the zips.
+    With a checkpoint, save the scores to the part file. Returns the stats for it, too.
+    """
+
+    key: str = unit_key(xx, chamber, e_id)
+    unit_stats: UnitStats
+    df: pd.DataFrame
+    n_files: int = 0
+
+    if resume:
+        assert part is not None
+        print(f"      Resuming {xx}, {chamber}, {e_id} ...")
+        unit_stats = UnitStats(key, "checkpoint")
+        with unit_stats.phase("parse"):
+            df = pd.read_parquet(part)
+        unit_stats.bytes_in = os.path.getsize(part)
+        unit_stats.rows = len(df)
+        return df, 0, unit_stats
+
+    if previous_path is None:
+        unit_stats = UnitStats(key, "zips")
+        df, n_files = read_ensemble_scores(input_dir, xx, chamber, e_id, unit_stats)
+    else:
+        print(f"      Reusing {xx}, {chamber}, {e_id} ...")
+        unit_stats = UnitStats(key, "previous")
+        with unit_stats.phase("parse"):
+            previous: pq.ParquetFile = pq.ParquetFile(previous_path)
+            df = previous.read_row_groups(row_groups).to_pandas()
+            for column in scores_keys:
+                df[column] = df[column].astype(str)
+        unit_stats.bytes_in = sum(
+            previous.metadata.row_group(i).total_byte_size for i in row_groups
+        )
+    unit_stats.rows = len(df)
+
+    if part is not None:
+        with unit_stats.phase("write"):
+            df.to_parquet(f"{part}.tmp", index=False)
+            os.replace(f"{part}.tmp", part)
+
+    return df, n_files, unit_stats
+
+
+def read_ensemble_scores(
+    input_dir: str, xx: str, chamber: str, e_id: str, unit_stats: UnitStats
+) -> Tuple[pd.DataFrame, int]:
+    """
+    Read the 6 scores CSVs for an ensemble, and merge them into one dataframe sorted by plan.
+    Returns the dataframe and the number of scores files read. Records the time in each phase in the stats.
+    """
+
+    with unit_stats.phase("open"):
+        catalog: Catalog = load_catalog(input_dir)  # Once per process
+        scores_files: List[ZipMember] = scores_members(catalog, xx, chamber, e_id)
+
+    # Parse each file straight from the (decompressed) stream & collect the scores.
+    # The files the zip stores uncompressed are read from a memory map of the zip, without copying.
+
+    category_dfs = []
+    for scores_file in scores_files:
+        print(f"      Loading {scores_file.name} ...")
+
+        unit_stats.bytes_in += scores_file.compress_size
+
+        with unit_stats.phase("open"):
+            member: pa.BufferReader = pa.BufferReader(catalog.buffer(scores_file))
+        with unit_stats.phase("decompress"):
+            csv_stream: Any = decompress_stream(scores_file.name, member)
+        with member, csv_stream, unit_stats.phase("parse"):
+            # Reading a compressed stream is decompressing it
+            df = pacsv.read_csv(
+                csv_stream
+                if csv_stream is member
+                else unit_stats.timed(csv_stream, "decompress")
+            ).to_pandas()
+
+        category_dfs.append(df)
+
+    with unit_stats.phase("merge"):
+        combined_df = category_dfs[0]
+        for df in category_dfs[1:]:
+            combined_df = combined_df.merge(df, on="map", how="outer")
+        combined_df = combined_df.sort_values(by="map", kind="stable").reset_index(
+            drop=True
+        )
+
+    combined_df["state"] = xx
+    combined_df["chamber"] = chamber
+    combined_df["ensemble"] = e_id
+
+    return combined_df, len(scores_files)
+
+
+def scores_members(
+    catalog: Catalog, xx: str, chamber: str, e_id: str
+) -> List[ZipMember]:
+    """Find the 6 scores CSVs for an ensemble in the catalog of the zips."""
+
+    scores_files: List[ZipMember] = catalog.members_for(xx, chamber, e_id, "scores")
+    assert len(scores_files) == 6, f"Expected 6 scores files, found {len(scores_files)}"
+
+    return scores_files
+
+
+def normalize_scores(df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """
+    Give the scores for an ensemble the same columns & dtypes as all the others: int64 plan ids and float64 metrics.
+    (The count metrics that turn out to be all whole numbers are made int64 again at the end, see int_counts_parquet.)
+    """
+
+    extra: List[str] = [c for c in df.columns if c not in columns]
+    assert not extra, f"Unexpected scores columns: {extra}"
+
+    normalized: pd.DataFrame = df.reindex(columns=columns)
+    for column in columns:
+        if column == "map":
+            normalized[column] = normalized[column].astype(np.int64)
+        elif column not in scores_keys:
+            normalized[column] = normalized[column].astype(np.float64)
+
+    return normalized
+
+
+def int_counts_parquet(scores_path: str, output: str, int_counts: List[str]) -> None:
+    """Rewrite a scores .parquet file with the given count metrics (all whole numbers) as int64, one row group at a time."""
+
+    scores_file: pq.ParquetFile = pq.ParquetFile(scores_path)
+    schema: pa.Schema = scores_file.schema_arrow
+    for metric in int_counts:
+        schema = schema.set(
+            schema.get_field_index(metric), pa.field(metric, pa.int64())
+        )
+
+    with pq.ParquetWriter(output, schema) as writer:
+        for i in range(scores_file.metadata.num_row_groups):
+            table: pa.Table = scores_file.read_row_group(i).cast(schema)
+            writer.write_table(table, row_group_size=max(table.num_rows, 1))
+
+
+def compact_parquet(
+    scores_path: str, output: str, count_types: Dict[str, Any], float32: bool
+) -> None:
+    """Rewrite a scores .parquet file with compact dtypes, one row group at a time."""
+
+    scores_file: pq.ParquetFile = pq.ParquetFile(scores_path)
+    writer: Optional[pq.ParquetWriter] = None
+    for i in range(scores_file.metadata.num_row_groups):
+        df: pd.DataFrame = compact_scores(
+            scores_file.read_row_group(i).to_pandas(),
+            float32=float32,
+            count_types=count_types,
+        )
+        table: pa.Table = pa.Table.from_pandas(df, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(output, table.schema)
+        writer.write_table(table, row_group_size=max(len(df), 1))
+
+    if writer is not None:
+        writer.close()
+
+
+def map_units(
+    fn: Callable[..., Any], units: Iterable[Tuple], jobs: int
+) -> Iterator[Tuple[Tuple, Any]]:
+    """
+    Apply a function to the arguments for each unit, in order, in a pool of processes if jobs > 1,
+    and yield each unit with its result. At most 2 x jobs units are in flight at a time,
+    so finished results don't pile up in memory (and units are drawn from a queue only as needed).
+    """
+
+    if jobs <= 1:
+        for unit in units:
+            yield unit, fn(*unit)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending: Deque[Tuple[Tuple, Future]] = deque()
+        for unit in units:
+            pending.append((unit, pool.submit(fn, *unit)))
+            if len(pending) >= 2 * jobs:
+                done, future = pending.popleft()
+                yield done, future.result()
+        while pending:
+            done, future = pending.popleft()
+            yield done, future.result()
+
+
+### HELPERS ###
+
+
+def _merge_types(a: Optional[np.dtype], b: np.dtype, not_counts: Any) -> np.dtype:
+    """The type that holds the values of a count metric for two sets of ensembles."""
+
+    if a is None:
+        return b
+    merged: np.dtype = np.promote_types(a, b)
+
+    return merged if np.issubdtype(merged, np.integer) else np.dtype(not_counts)
 
 
 def parse_arguments():
@@ -172,6 +555,52 @@ def parse_arguments():
         help="The path to the output .parquet file",
     )
 
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="The number of processes that read the zips in parallel",
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        action="store_true",
+        help="Only re-read the ensembles whose scores files changed since the last build",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        help="A directory for checkpointing the build, so a restarted build skips the ensembles already done",
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        help="As the i-th of N workers (i/N, 0 <= i < N), only build every N-th ensemble into the --checkpoint directory",
+    )
+    parser.add_argument(
+        "--queue",
+        dest="queue",
+        action="store_true",
+        help="As one of several workers, claim ensembles from a queue in the --checkpoint directory and only build those",
+    )
+    parser.add_argument(
+        "--stats",
+        type=str,
+        help="The path to a .json file for the time in each phase of the build, the throughput, and the peak memory",
+    )
+    parser.add_argument(
+        "--compact",
+        dest="compact",
+        action="store_true",
+        help="Store the scores with compact dtypes",
+    )
+    parser.add_argument(
+        "--float32",
+        dest="float32",
+        action="store_true",
+        help="With --compact, also store the real-valued metrics as float32",
+    )
+
     parser.add_argument("--debug", dest="debug", action="store_true", help="Debug mode")
     parser.add_argument(
         "-v", "--verbose", dest="verbose", action="store_true", help="Verbose mode"
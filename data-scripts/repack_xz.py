@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+REPACK THE ZIPPED ENSEMBLES AS MULTI-BLOCK XZ
+
+The .xz files in the zips are each a single xz block, so they decompress on one core.
+This script rewrites each of the 22 zips with its .xz files re-encoded as independent blocks
+(concatenated single-block xz streams), which the loaders decompress in parallel, a thread per
+core (see data/codecs.py). Any xz decoder still reads them. All the other files are copied as is.
+When the loaders can use zstd, data-scripts/transcode_zstd.py is faster still.
+
+To use this script, run it from the root of the repository:
+    ```
+    PYTHONPATH=. data-scripts/repack_xz.py \
+    --input /path/to/zip/directory \
+    --output /path/to/repacked/zip/directory
+    ```
+
+    Add --jobs N to repack N zips at a time.
+    Add --preset P to set the xz compression preset (default 6), and
+    --block-size MB to set the size of the (decompressed) blocks (default 4 MB).
+
+"""
+
+from typing import Any, BinaryIO, Callable
+
+from argparse import ArgumentParser, Namespace
+
+from functools import partial
+
+from data.codecs import XzBlocksWriter
+
+from buildutils import rewrite_zips
+
+
+def main() -> None:
+    """Repack the .xz files in the zips as multi-block xz."""
+
+    rewrite_zips("repack", "repacked", ".xz", add_xz_arguments, xz_writer)
+
+    pass
+
+
+def xz_writer(args: Namespace) -> Callable[[BinaryIO], Any]:
+    """Make the multi-block xz writers for the repacked files."""
+
+    return partial(XzBlocksWriter, preset=args.preset, block_size=args.block_size << 20)
+
+
+### HELPERS ###
+
+
+def add_xz_arguments(parser: ArgumentParser) -> None:
+    """Add the xz command line arguments."""
+
+    parser.add_argument(
+        "--preset",
+        type=int,
+        default=6,
+        help="The xz compression preset",
+    )
+    parser.add_argument(
+        "--block-size",
+        dest="block_size",
+        type=int,
+        default=4,
+        help="The (decompressed) size of the xz blocks, in MB",
+    )
+
+
+if __name__ == "__main__":
+    main()
+
+### END ###
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+TRANSCODE THE ZIPPED ENSEMBLES FROM XZ TO SEEKABLE ZSTD
+
+Decompressing the .xz files in the zips is single-threaded and slow. This script rewrites each
+of the 22 zips with its .xz files re-encoded as seekable, multi-frame zstd (.zst) files, which
+decompress many times faster and can be read a frame at a time (see data/codecs.py).
+All the other files are copied as is. The loaders read either format transparently.
+
+To use this script:
+
+(1) Install dependencies:
+    `pip install zstandard`
+
+(2) Run the script from the root of the repository:
+    ```
+    PYTHONPATH=. data-scripts/transcode_zstd.py \
+    --input /path/to/zip/directory \
+    --output /path/to/transcoded/zip/directory
+    ```
+
+    Add --jobs N to transcode N zips at a time.
+    Add --level L to set the zstd compression level (default 3), and
+    --frame-size MB to set the size of the (decompressed) frames (default 4 MB).
+
+"""
+
+from typing import Any, BinaryIO, Callable
+
+from argparse import ArgumentParser, Namespace
+
+from functools import partial
+
+from data.codecs import SeekableZstdWriter
+
+from buildutils import rewrite_zips
+
+
+def main() -> None:
+    """Transcode the .xz files in the zips to seekable zstd."""
+
+    rewrite_zips("transcode", "transcoded", ".zst", add_zstd_arguments, zstd_writer)
+
+    pass
+
+
+def zstd_writer(args: Namespace) -> Callable[[BinaryIO], Any]:
+    """Make the seekable zstd writers for the transcoded files."""
+
+    return partial(
+        SeekableZstdWriter, level=args.level, frame_size=args.frame_size << 20
+    )
+
+
+### HELPERS ###
+
+
+def add_zstd_arguments(parser: ArgumentParser) -> None:
+    """Add the zstd command line arguments."""
+
+    parser.add_argument(
+        "--level",
+        type=int,
+        default=3,
+        help="The zstd compression level",
+    )
+    parser.add_argument(
+        "--frame-size",
+        dest="frame_size",
+        type=int,
+        default=4,
+        help="The (decompressed) size of the zstd frames, in MB",
+    )
+
+
+if __name__ == "__main__":
+    main()
+
+### END ###
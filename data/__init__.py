@@ -3,10 +3,29 @@
 from .constants import *
 from .helpers import (
     load_scores,
+    load_arrow_scores,
+    iter_scores,
+    sample_scores,
+    validate_scores,
     arr_from_scores,
     df_from_scores,
     load_aggregates,
+    load_aggregate_arrays,
     arr_from_aggregates,
 )
+from .aggstore import (
+    AggregatesStore,
+    StoredAggregates,
+    load_stored_aggregates,
+)
+from .cache import enable_cache, disable_cache, clear_cache
+from .catalog import Catalog, ZipMember, load_catalog, build_catalog
+from .indexes import ScoresIndex, LazyScores, ArrowScores
+from .bitmaps import (
+    BitmapIndex,
+    build_bitmap_index,
+    load_bitmap_index,
+    bitmap_index_path,
+)
 
 name: str = "data"
@@ -0,0 +1,249 @@
+"""
+A MEMORY-MAPPED COLUMNAR STORE FOR THE BY-DISTRICT AGGREGATES
+
+Loading aggregates from the zips means decompressing & parsing a whole JSONL file per call.
+Instead, data-scripts/make_aggregates_store.py converts them once into a directory of .npy files:
+each aggregate for a state, chamber, and ensemble is a 2D plans x districts array, with the
+statewide value in column 0, memory-mapped when it is read. Nothing is parsed, and just the pages
+that are used are read. For example:
+
+    from data import load_stored_aggregates, arr_from_aggregates
+
+    partisan = load_stored_aggregates("NC", "congress", "A0", "partisan", store_dir)
+    dem = arr_from_aggregates("dem_by_district", partisan)
+
+The layout is {store}/{xx}/{chamber}/{ensemble}/{aggregate}.npy, with the plan names in names.npy,
+and an index of the contents in {store}/index.json. The ensemble directory names are slugs of
+the ensemble ids, as "Rev*", "Pop+", and "Pop-" aren't portable file names.
+"""
+
+from typing import Any, Dict, List, Tuple
+
+import os
+import json
+import numpy as np
+
+from .constants import (
+    states,
+    chambers,
+    ensembles,
+    aggregates_by_category,
+    aggregate_categories,
+    datasets_by_aggregate_category,
+)
+
+Key = Tuple[str, str, str]
+
+_store_version: int = 1
+
+
+class AggregatesStore:
+    """A store of by-district aggregates, by state, chamber, ensemble, and aggregate (see make_aggregates_store.py)."""
+
+    def __init__(self, store_dir: str) -> None:
+        self.store_dir: str = os.path.expanduser(store_dir)
+        index_path: str = aggregates_store_index_path(self.store_dir)
+        assert os.path.exists(index_path), f"No aggregates store index at {index_path}"
+
+        with open(index_path, "r") as index_file:
+            index: Dict[str, Any] = json.load(index_file)
+        assert (
+            index.get("version") == _store_version
+        ), f"Unsupported aggregates store version in {index_path}"
+        self.index: Dict[str, Dict[str, Any]] = index["ensembles"]
+
+    def keys(self) -> List[Key]:
+        """The state, chamber, and ensemble combinations in the store."""
+
+        return [tuple(key.split("/")) for key in self.index]  # type: ignore
+
+    def aggregates(self, xx: str, chamber: str, ensemble: str) -> List[str]:
+        """The aggregates stored for a state, chamber, and ensemble."""
+
+        return list(self._entry(xx, chamber, ensemble)["aggregates"])
+
+    def names(self, xx: str, chamber: str, ensemble: str) -> np.ndarray:
+        """The names of the plans, in the order of the rows of the arrays."""
+
+        self._entry(xx, chamber, ensemble)
+
+        return np.load(os.path.join(self._dir(xx, chamber, ensemble), "names.npy"))
+
+    def array(
+        self,
+        xx: str,
+        chamber: str,
+        ensemble: str,
+        aggregate: str,
+        *,
+        include_statewide: bool = False,
+    ) -> np.ndarray:
+        """
+        A by-district aggregate for a state, chamber, and ensemble: a (read-only, memory-mapped)
+        2D array with a row per plan and a column per district. By default, the statewide values
+        (column 0) are not included.
+        """
+
+        entry: Dict[str, Any] = self._entry(xx, chamber, ensemble)
+        assert (
+            aggregate in entry["aggregates"]
+        ), f"Aggregate {aggregate} not stored for {xx}, {chamber}, {ensemble}"
+
+        arr: np.ndarray = np.load(
+            os.path.join(self._dir(xx, chamber, ensemble), f"{aggregate}.npy"),
+            mmap_mode="r",
+        )
+
+        return arr if include_statewide else arr[:, 1:]
+
+    def _entry(self, xx: str, chamber: str, ensemble: str) -> Dict[str, Any]:
+        key: str = f"{xx}/{chamber}/{ensemble}"
+        assert (
+            key in self.index
+        ), f"{xx}, {chamber}, {ensemble} not in the aggregates store"
+
+        return self.index[key]
+
+    def _dir(self, xx: str, chamber: str, ensemble: str) -> str:
+        return os.path.join(self.store_dir, xx, chamber, ensemble_slug(ensemble))
+
+
+class StoredAggregates:
+    """
+    The aggregates in a category for a state, chamber, and ensemble in an aggregates store.
+    Pass it to arr_from_aggregates like the records from load_aggregates.
+    Just the aggregates in the category that are in the store's index are available.
+    """
+
+    def __init__(
+        self,
+        store: AggregatesStore,
+        xx: str,
+        chamber: str,
+        ensemble: str,
+        category: str,
+        minority_dataset: str = "vap",
+    ) -> None:
+        assert (
+            category != "minority"
+            or minority_dataset in datasets_by_aggregate_category["minority"]
+        ), f"Invalid minority dataset: {minority_dataset}"
+
+        self.store: AggregatesStore = store
+        self.key: Key = (xx, chamber, ensemble)
+        self.category: str = category
+
+        stored: List[str] = store.aggregates(xx, chamber, ensemble)
+        self.available: List[str] = [
+            agg
+            for agg in aggregates_by_category[category]
+            if (category != "minority" or agg.endswith(f"_{minority_dataset}"))
+            and agg in stored
+        ]
+
+    def __contains__(self, aggregate: str) -> bool:
+        return aggregate in self.available
+
+    def array(self, aggregate: str, *, include_statewide: bool = False) -> np.ndarray:
+        assert (
+            aggregate in self.available
+        ), f"Aggregate {aggregate} not stored for {', '.join(self.key)} ({self.category})"
+
+        return self.store.array(
+            *self.key, aggregate, include_statewide=include_statewide
+        )
+
+
+_stores: Dict[str, AggregatesStore] = dict()
+
+
+def load_stored_aggregates(
+    xx: str,
+    chamber: str,
+    ensemble: str,
+    category: str,
+    store_dir: str,
+    *,
+    minority_dataset: str = "vap",
+) -> StoredAggregates:
+    """Like load_aggregates, but from an aggregates store. Nothing is read until an aggregate is used."""
+
+    assert xx in states, f"Invalid state: {xx}"
+    assert chamber in chambers, f"Invalid chamber: {chamber}"
+    assert ensemble in ensembles, f"Invalid ensemble: {ensemble}"
+    assert category in aggregate_categories, f"Invalid aggregates category: {category}"
+
+    store_dir = os.path.abspath(os.path.expanduser(store_dir))
+    if store_dir not in _stores:
+        _stores[store_dir] = AggregatesStore(store_dir)
+
+    return StoredAggregates(
+        _stores[store_dir], xx, chamber, ensemble, category, minority_dataset
+    )
+
+
+def write_stored_aggregates(
+    store_dir: str,
+    xx: str,
+    chamber: str,
+    ensemble: str,
+    names: List[str],
+    arrays: Dict[str, np.ndarray],
+) -> Dict[str, Any]:
+    """
+    Write the aggregates for a state, chamber, and ensemble to a store, and return their index entry.
+    (The index itself is written by write_aggregates_store_index, once all of them are written.)
+    """
+
+    ensemble_dir: str = os.path.join(
+        os.path.expanduser(store_dir), xx, chamber, ensemble_slug(ensemble)
+    )
+    os.makedirs(ensemble_dir, exist_ok=True)
+
+    np.save(os.path.join(ensemble_dir, "names.npy"), np.array(names))
+    for aggregate, arr in arrays.items():
+        assert arr.ndim == 2 and arr.shape[0] == len(
+            names
+        ), f"Aggregate {aggregate} for {xx}, {chamber}, {ensemble} isn't plans x districts"
+        np.save(os.path.join(ensemble_dir, f"{aggregate}.npy"), arr)
+
+    return {
+        "plans": len(names),
+        "aggregates": {
+            aggregate: {"shape": list(arr.shape), "dtype": str(arr.dtype)}
+            for aggregate, arr in arrays.items()
+        },
+    }
+
+
+def write_aggregates_store_index(
+    store_dir: str, entries: Dict[Key, Dict[str, Any]]
+) -> None:
+    """Write the index of an aggregates store."""
+
+    index_path: str = aggregates_store_index_path(store_dir)
+    with open(f"{index_path}.tmp", "w") as index_file:
+        json.dump(
+            {
+                "version": _store_version,
+                "ensembles": {"/".join(key): entry for key, entry in entries.items()},
+            },
+            index_file,
+            indent=1,
+        )
+    os.replace(f"{index_path}.tmp", index_path)
+
+
+def aggregates_store_index_path(store_dir: str) -> str:
+    """The path of the index of an aggregates store."""
+
+    return os.path.join(os.path.expanduser(store_dir), "index.json")
+
+
+def ensemble_slug(ensemble: str) -> str:
+    """A portable directory name for an ensemble id, e.g., 'Rev*' -> 'Rev_star'."""
+
+    return ensemble.replace("*", "_star").replace("+", "_plus").replace("-", "_minus")
+
+
+### END ###
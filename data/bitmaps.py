@@ -0,0 +1,249 @@
+"""
+BINNED BITMAP INDEX FOR MULTI-METRIC PLAN FILTERING
+
+For each state, chamber, and ensemble and each metric, the plans' values are binned
+(into equal-frequency bins, or one bin per value if there are only a few distinct values),
+and each bin is stored as a bitmap over the plans plus the min & max value in the bin.
+
+A conjunctive range query -- e.g., efficiency_gap < 0.05 and polsby_popper > 0.3 and
+counties_split <= 20 -- is answered by ORing the bitmaps of the bins that satisfy each
+condition and ANDing the results across conditions. Only the plans in bins that straddle
+a condition's value are checked against the actual scores.
+"""
+
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
+
+import os
+import operator
+import numpy as np
+import pandas as pd
+
+from .constants import metrics
+from .indexes import ScoresIndex, LazyScores, ArrowScores
+
+Key = Tuple[str, str, str]
+Condition = Tuple[str, str, float]
+Scores = Union[pd.DataFrame, ScoresIndex, LazyScores, ArrowScores]
+
+_ops: Dict[str, Callable[[Any, Any], Any]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+}
+
+
+class BitmapIndex:
+    """A binned bitmap index over the scores, by state, chamber, and ensemble and metric."""
+
+    def __init__(self, arrays: Mapping[str, np.ndarray]) -> None:
+        self.arrays: Mapping[str, np.ndarray] = arrays
+        self.metrics: List[str] = [str(m) for m in arrays["metrics"]]
+        self._groups: Dict[Key, Dict[str, np.ndarray]] = dict()
+        self._indexed: Optional[Tuple[pd.DataFrame, ScoresIndex]] = None
+
+    def save(self, index_path: str) -> None:
+        """Write the index to a .npz file, e.g., next to scores.parquet (see bitmap_index_path)."""
+
+        np.savez(os.path.expanduser(index_path), **dict(self.arrays.items()))
+
+    def query(
+        self,
+        xx: str,
+        chamber: str,
+        ensemble: str,
+        conditions: List[Condition],
+        scores: Optional[Scores] = None,
+    ) -> np.ndarray:
+        """
+        Find the plans for a state, chamber, and ensemble that satisfy all the conditions,
+        e.g., [("efficiency_gap", "<", 0.05), ("polsby_popper", ">", 0.3), ("counties_split", "<=", 20)].
+        Returns their plan ("map") ids.
+
+        The scores (the same ones the index was built from) are only needed to check the plans
+        in bins that straddle a condition's value; without them, such a query raises a ValueError.
+        """
+
+        group: Dict[str, np.ndarray] = self._group((xx, chamber, ensemble))
+        n: int = len(group["map"])
+        result: np.ndarray = np.packbits(np.ones(n, dtype=bool))
+
+        if isinstance(scores, pd.DataFrame):
+            scores = self._scores_index(scores)
+
+        for metric, op, value in conditions:
+            assert metric in self.metrics, f"Metric {metric} not in the index"
+            assert op in _ops, f"Invalid operator: {op}"
+
+            i: int = self.metrics.index(metric)
+            bitmaps: np.ndarray = group["bitmaps"][i]
+            all_in, some_in = _bins_in(group["lo"][i], group["hi"][i], op, value)
+
+            matches: np.ndarray = _or(bitmaps[all_in], result.size)
+            candidates: np.ndarray = _or(bitmaps[some_in], result.size) & result
+            if candidates.any():
+                if scores is None:
+                    raise ValueError(
+                        f"The scores are needed to check {metric} {op} {value} for {xx}, {chamber}, {ensemble}"
+                    )
+                values: np.ndarray = scores.array(xx, chamber, ensemble, metric)
+                assert len(values) == n, "The scores don't match the index"
+
+                rows: np.ndarray = np.flatnonzero(np.unpackbits(candidates, count=n))
+                checked: np.ndarray = np.zeros(n, dtype=bool)
+                checked[rows[_ops[op](values[rows], value)]] = True
+                matches |= np.packbits(checked)
+
+            result &= matches
+
+        plans: np.ndarray = group["map"][np.flatnonzero(np.unpackbits(result, count=n))]
+
+        return plans
+
+    def _scores_index(self, scores: pd.DataFrame) -> ScoresIndex:
+        """Index a scores DataFrame, once: the index is kept for the next query with the same DataFrame."""
+
+        if self._indexed is None or self._indexed[0] is not scores:
+            self._indexed = (scores, ScoresIndex(scores))
+
+        return self._indexed[1]
+
+    def _group(self, key: Key) -> Dict[str, np.ndarray]:
+        """The arrays for a state, chamber, and ensemble (read on first access, then cached)."""
+
+        if key not in self._groups:
+            prefix: str = "/".join(key)
+            assert f"{prefix}/map" in self.arrays, f"{key} not in the index"
+            self._groups[key] = {
+                name: self.arrays[f"{prefix}/{name}"]
+                for name in ["map", "bitmaps", "lo", "hi"]
+            }
+
+        return self._groups[key]
+
+
+def build_bitmap_index(scores: Scores, *, bins: int = 16) -> BitmapIndex:
+    """Build a binned bitmap index over all the metrics in the scores, for each state, chamber, and ensemble."""
+
+    if isinstance(scores, pd.DataFrame):
+        scores = ScoresIndex(scores)
+
+    indexed: List[str] = [m for m in metrics if m in _columns(scores)]
+    arrays: Dict[str, np.ndarray] = {"metrics": np.array(indexed)}
+
+    for xx, chamber, ensemble in scores.keys():
+        prefix: str = f"{xx}/{chamber}/{ensemble}"
+        arrays[f"{prefix}/map"] = np.asarray(scores.array(xx, chamber, ensemble, "map"))
+
+        binned: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = [
+            _bin(np.asarray(scores.array(xx, chamber, ensemble, m), dtype=float), bins)
+            for m in indexed
+        ]
+        n_bins: int = max((len(lo) for _, lo, _ in binned), default=0)
+        n_bytes: int = (len(arrays[f"{prefix}/map"]) + 7) // 8
+
+        # Pad the bins for each metric to the same number: empty bitmaps that match nothing
+        bitmaps: np.ndarray = np.zeros((len(indexed), n_bins, n_bytes), dtype=np.uint8)
+        lo: np.ndarray = np.full((len(indexed), n_bins), np.nan)
+        hi: np.ndarray = np.full((len(indexed), n_bins), np.nan)
+        for i, (b, l, h) in enumerate(binned):
+            bitmaps[i, : len(l)] = b
+            lo[i, : len(l)] = l
+            hi[i, : len(l)] = h
+
+        arrays[f"{prefix}/bitmaps"] = bitmaps
+        arrays[f"{prefix}/lo"] = lo
+        arrays[f"{prefix}/hi"] = hi
+
+    return BitmapIndex(arrays)
+
+
+def load_bitmap_index(index_path: str) -> BitmapIndex:
+    """Open a bitmap index .npz file. The arrays for each state, chamber, and ensemble are read on first use."""
+
+    return BitmapIndex(np.load(os.path.expanduser(index_path)))
+
+
+def bitmap_index_path(scores_path: str) -> str:
+    """The path of the bitmap index for a scores .parquet file, next to it."""
+
+    root, _ = os.path.splitext(os.path.expanduser(scores_path))
+
+    return f"{root}.bitmaps.npz"
+
+
+### HELPERS ###
+
+
+def _columns(scores: Union[ScoresIndex, LazyScores, ArrowScores]) -> List[str]:
+    """The column names of the scores."""
+
+    if isinstance(scores, ScoresIndex):
+        return list(scores.df.columns)
+    if isinstance(scores, LazyScores):
+        return list(scores.file.schema_arrow.names)
+
+    return list(scores.table.column_names)
+
+
+def _bin(values: np.ndarray, bins: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Bin the values of a metric. Returns the packed bitmap for each bin
+    and the min & max value in each bin. NaN values aren't in any bin.
+    """
+
+    valid: np.ndarray = values[~np.isnan(values)]
+    distinct: np.ndarray = np.unique(valid)
+    edges: np.ndarray = (
+        distinct
+        if len(distinct) <= bins
+        else np.unique(np.quantile(valid, np.linspace(0, 1, bins + 1))[:-1])
+    )
+
+    ids: np.ndarray = np.searchsorted(edges, values, side="right") - 1
+    ids[np.isnan(values)] = -1
+
+    bitmaps: List[np.ndarray] = list()
+    lo: List[float] = list()
+    hi: List[float] = list()
+    for b in range(len(edges)):
+        in_bin: np.ndarray = ids == b
+        if not in_bin.any():
+            continue
+        bitmaps.append(np.packbits(in_bin))
+        lo.append(values[in_bin].min())
+        hi.append(values[in_bin].max())
+
+    return np.array(bitmaps, dtype=np.uint8), np.array(lo), np.array(hi)
+
+
+def _bins_in(
+    lo: np.ndarray, hi: np.ndarray, op: str, value: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Which bins have all their values satisfy a condition, and which have just some of them."""
+
+    if op == "==":
+        all_in: np.ndarray = (lo == value) & (hi == value)
+        none_in: np.ndarray = ~((lo <= value) & (value <= hi))
+    else:
+        at_lo: np.ndarray = _ops[op](lo, value)
+        at_hi: np.ndarray = _ops[op](hi, value)
+        # The values that satisfy <, <=, >, or >= are a half-line, so if neither end of a bin does, none do.
+        all_in = at_lo & at_hi
+        none_in = ~at_lo & ~at_hi
+
+    return all_in, ~all_in & ~none_in
+
+
+def _or(bitmaps: np.ndarray, n_bytes: int) -> np.ndarray:
+    """OR packed bitmaps together."""
+
+    return (
+        np.bitwise_or.reduce(bitmaps, axis=0)
+        if len(bitmaps)
+        else np.zeros(n_bytes, dtype=np.uint8)
+    )
+
+
+### END ###
@@ -0,0 +1,255 @@
+"""
+AN OPT-IN, ON-DISK CACHE OF DECODED FILES FROM THE ZIPS
+
+Loading the by-district aggregates (or an ensemble) from the zips decompresses & parses the
+same files every time, e.g., after every notebook kernel restart. With the cache enabled,
+the decoded result is saved in a local directory in a fast binary form (.npz arrays, or
+the raw decompressed bytes), so loading it again is just a file read:
+
+    from data import enable_cache
+
+    enable_cache("~/.cache/ensembles", max_size_mb=10_000)
+
+Or set the DATA_CACHE_DIR environment variable (and optionally DATA_CACHE_MAX_MB).
+
+The cached files are keyed by the zip's path, the file's name in the zip, and its CRC
+from the zip's central directory, so a changed zip is never read from a stale cache.
+When the cache grows past its size cap, the least recently used files are evicted.
+clear_cache() empties it. Only the cache's own files (named by a SHA-1 hash of those keys) are
+ever evicted or deleted, so the directory can be shared. Temporary files left by a writer that
+crashed are deleted after an hour.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import os
+import re
+import time
+import hashlib
+import numpy as np
+
+from .catalog import ZipMember
+from .codecs import Buffer
+
+_default_max_size_mb: int = 10_000
+_stale_after: int = 60 * 60  # Seconds, for temporary files
+_cache_version: int = 2  # Of what is cached for a file: bump it when that changes
+
+_entry_pattern: re.Pattern = re.compile(r"^[0-9a-f]{40}\.(?:npz|bin)$")
+_tmp_pattern: re.Pattern = re.compile(r"^[0-9a-f]{40}\.(?:npz|bin)\.[0-9]+\.tmp$")
+
+_cache_dir: Optional[str] = None
+_max_size: int = _default_max_size_mb << 20
+
+
+def enable_cache(cache_dir: str, *, max_size_mb: int = _default_max_size_mb) -> None:
+    """Cache decoded files in a directory, evicting the least recently used ones past max_size_mb."""
+
+    global _cache_dir, _max_size
+
+    assert max_size_mb > 0, f"Invalid cache size: {max_size_mb} MB"
+    _cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    _max_size = max_size_mb << 20
+    os.makedirs(_cache_dir, exist_ok=True)
+    _remove_stale_files()
+
+
+def disable_cache() -> None:
+    """Stop using the cache (its contents are kept)."""
+
+    global _cache_dir
+
+    _cache_dir = None
+
+
+def cache_enabled() -> bool:
+    return _cache_dir is not None
+
+
+def clear_cache() -> None:
+    """Delete everything in the cache."""
+
+    if _cache_dir is None:
+        return
+
+    for path, _, _ in _cached_files():
+        _remove(path)
+    _remove_stale_files()
+
+
+def cache_file_path(name: str) -> Optional[str]:
+    """
+    The path of a file of another kind kept in the cache directory, e.g., a catalog of the zips
+    (see data/catalog.py). None if the cache is off. It is not evicted or cleared with the entries.
+    """
+
+    if _cache_dir is None:
+        return None
+
+    return os.path.join(_cache_dir, name)
+
+
+### ARRAYS ###
+
+
+def load_cached_arrays(
+    member: ZipMember, variant: str = ""
+) -> Optional[Dict[str, np.ndarray]]:
+    """The arrays cached for a file in the zips (and a variant of decoding it), or None."""
+
+    path: Optional[str] = _hit(member, variant, ".npz")
+    if path is None:
+        return None
+
+    try:
+        with np.load(path, allow_pickle=False) as cached:
+            return {key: cached[key] for key in cached.files}
+    except FileNotFoundError:
+        return None  # Just evicted by another process
+
+
+def save_cached_arrays(
+    member: ZipMember, arrays: Dict[str, np.ndarray], variant: str = ""
+) -> None:
+    """Cache the arrays decoded from a file in the zips."""
+
+    path: Optional[str] = _entry_path(member, variant, ".npz")
+    if path is None:
+        return
+
+    with open(f"{path}.{os.getpid()}.tmp", "wb") as cache_file:
+        np.savez(cache_file, **arrays)
+    _commit(path)
+
+
+### BYTES ###
+
+
+def load_cached_bytes(member: ZipMember, variant: str = "") -> Optional[bytes]:
+    """The (e.g., decompressed) contents cached for a file in the zips, or None."""
+
+    path: Optional[str] = _hit(member, variant, ".bin")
+    if path is None:
+        return None
+
+    try:
+        with open(path, "rb") as cache_file:
+            return cache_file.read()
+    except FileNotFoundError:
+        return None  # Just evicted by another process
+
+
+def save_cached_bytes(member: ZipMember, data: Buffer, variant: str = "") -> None:
+    """Cache the (e.g., decompressed) contents of a file in the zips."""
+
+    path: Optional[str] = _entry_path(member, variant, ".bin")
+    if path is None:
+        return
+
+    with open(f"{path}.{os.getpid()}.tmp", "wb") as cache_file:
+        cache_file.write(data)
+    _commit(path)
+
+
+### HELPERS ###
+
+
+def _entry_path(member: ZipMember, variant: str, suffix: str) -> Optional[str]:
+    """The path of a file's entry in the cache, keyed by its zip, name, and CRC. None if the cache is off."""
+
+    if _cache_dir is None:
+        return None
+
+    key: str = "|".join(
+        [
+            os.path.abspath(member.zip_path),
+            member.name,
+            f"{member.crc:08x}",
+            variant,
+            str(_cache_version),
+        ]
+    )
+
+    return os.path.join(_cache_dir, hashlib.sha1(key.encode()).hexdigest() + suffix)
+
+
+def _hit(member: ZipMember, variant: str, suffix: str) -> Optional[str]:
+    """The path of a file's entry in the cache, if it is there, marked as just used."""
+
+    path: Optional[str] = _entry_path(member, variant, suffix)
+    if path is None or not os.path.exists(path):
+        return None
+
+    try:
+        os.utime(path)  # The modification time orders the entries for eviction
+    except FileNotFoundError:
+        return None  # Just evicted by another process
+
+    return path
+
+
+def _commit(path: str) -> None:
+    """Move a newly written entry into place, and evict the least recently used entries past the size cap."""
+
+    os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    entries: List[Tuple[str, int, float]] = sorted(
+        _cached_files(), key=lambda entry: entry[2]
+    )
+    total: int = sum(size for _, size, _ in entries)
+    for entry_path, size, _ in entries:
+        if total <= _max_size:
+            break
+        if entry_path == path:
+            continue  # Keep the newest entry, even if it alone is over the cap
+        _remove(entry_path)
+        total -= size
+
+
+def _cached_files() -> List[Tuple[str, int, float]]:
+    """The paths, sizes, and modification times of the entries in the cache."""
+
+    return [(path, stat.st_size, stat.st_mtime) for path, stat in _scan(_entry_pattern)]
+
+
+def _remove_stale_files() -> None:
+    """Delete the temporary files of writes that never finished, e.g., in a process that crashed."""
+
+    now: float = time.time()
+    for path, stat in _scan(_tmp_pattern):
+        if now - stat.st_mtime > _stale_after:
+            _remove(path)
+
+
+def _scan(pattern: re.Pattern) -> List[Tuple[str, os.stat_result]]:
+    """The paths & stats of the cache's files with names that match a pattern. Other files are left alone."""
+
+    assert _cache_dir is not None
+
+    found: List[Tuple[str, os.stat_result]] = list()
+    with os.scandir(_cache_dir) as entries:
+        for entry in entries:
+            if not pattern.match(entry.name) or not entry.is_file():
+                continue
+            try:
+                found.append((entry.path, entry.stat()))
+            except FileNotFoundError:
+                continue
+
+    return found
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+if os.environ.get("DATA_CACHE_DIR"):
+    enable_cache(
+        os.environ["DATA_CACHE_DIR"],
+        max_size_mb=int(os.environ.get("DATA_CACHE_MAX_MB", _default_max_size_mb)),
+    )
+
+### END ###
@@ -0,0 +1,378 @@
+"""
+A CATALOG OF THE FILES IN THE ZIPPED ENSEMBLES
+
+The 22 zips (7 x 3 = 21 xx_chamber zips + 1 reversible.long zip) hold thousands of files.
+Rather than list each zip and match a file name pattern on every call, the zips are scanned
+once and the files are indexed by state, chamber, ensemble, kind, and category:
+
+    kind          category
+    "scores"      a metric category, e.g., "proportionality"  ({name}_{category}_scores.csv[.xz])
+    "bydistrict"  an aggregate category, e.g., "partisan"     ({name}_{category}_bydistrict.jsonl[.xz])
+    "ensemble"    None                                        ({name}_ensemble.jsonl[.xz])
+
+Each file is recorded with its zip, its name in the zip, the offset of its data in the zip,
+how the zip stores it (compression method & sizes), and its CRC32. That also takes care of the
+"Rev" ensembles living in a different zip (reversible.long.zip) with a different layout.
+
+The files a zip stores uncompressed can be read as zero-copy views of a memory map of the zip
+(see Catalog.buffer), which processes share through the page cache.
+
+The catalog is saved and rebuilt if any zip changes. It is saved in the cache directory, if the cache
+is enabled (see data/cache.py), so nothing is written to the zip directory. Otherwise, it is saved as
+catalog.json in the zip directory, if that is writable, or just kept in memory.
+"""
+
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import os
+import re
+import mmap
+import json
+import struct
+import hashlib
+import zipfile
+
+from .constants import (
+    states,
+    chambers,
+    ensembles,
+    metric_categories,
+    aggregate_categories,
+)
+from .filenames import get_ensemble_name
+
+CatalogKey = Tuple[str, str, str, str, Optional[str]]
+
+kinds: List[str] = ["scores", "bydistrict", "ensemble"]
+
+_catalog_version: int = 2
+
+_member_pattern: re.Pattern = re.compile(
+    r"_(?:(?P<category>[a-z]+)_(?P<kind>scores|bydistrict)\.(?:csv|jsonl)|(?P<ensemble>ensemble)\.jsonl)(?:\.xz|\.zst)?$"
+)
+
+
+class ZipMember(NamedTuple):
+    """Where a file is in a zip, and how it is stored."""
+
+    zip_path: str
+    name: str
+    offset: int  # Of the file's data, after its local header
+    compress_type: int  # zipfile.ZIP_STORED, ZIP_DEFLATED, ...
+    compress_size: int
+    file_size: int
+    crc: int
+
+
+class Catalog:
+    """The files in the zips in a directory, by state, chamber, ensemble, kind, and category."""
+
+    def __init__(
+        self,
+        zip_dir: str,
+        members: Dict[CatalogKey, ZipMember],
+        stamps: Dict[str, List[int]],
+    ) -> None:
+        self.zip_dir: str = zip_dir
+        self.members: Dict[CatalogKey, ZipMember] = members
+        # The zips' sizes & modification times, to tell if the catalog is stale
+        self.stamps: Dict[str, List[int]] = stamps
+
+        # The files of each kind for each ensemble, in the order they are in the zip
+        self._by_ensemble: Dict[Tuple[str, str, str, str], List[ZipMember]] = dict()
+        for key, member in members.items():
+            self._by_ensemble.setdefault(key[:4], []).append(member)  # type: ignore
+
+        self._zips: Dict[str, zipfile.ZipFile] = dict()
+        self._maps: Dict[str, mmap.mmap] = dict()
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def member(
+        self,
+        xx: str,
+        chamber: str,
+        ensemble: str,
+        kind: str,
+        category: Optional[str] = None,
+    ) -> ZipMember:
+        """Find a file, e.g., the partisan by-district aggregates for an ensemble."""
+
+        key: CatalogKey = (xx, chamber, ensemble, kind, category)
+        assert key in self.members, f"No {kind} file found for {key} in {self.zip_dir}"
+
+        return self.members[key]
+
+    def members_for(
+        self, xx: str, chamber: str, ensemble: str, kind: str
+    ) -> List[ZipMember]:
+        """Find the files of a kind for an ensemble, e.g., its scores files, in the order they are in the zip."""
+
+        found: List[ZipMember] = list(
+            self._by_ensemble.get((xx, chamber, ensemble, kind), [])
+        )
+
+        return found
+
+    def open(self, member: ZipMember) -> BinaryIO:
+        """Open a file in its zip for reading. Each zip is opened once (per catalog)."""
+
+        if member.zip_path not in self._zips:
+            self._zips[member.zip_path] = zipfile.ZipFile(member.zip_path)
+
+        return self._zips[member.zip_path].open(member.name)  # type: ignore
+
+    def read(self, member: ZipMember) -> bytes:
+        """
+        Read a file from its zip. Files the zip stores uncompressed (e.g., in reversible.long.zip)
+        are read straight from their offset, without opening the zip.
+        """
+
+        if member.compress_type != zipfile.ZIP_STORED:
+            with self.open(member) as member_stream:
+                return member_stream.read()
+
+        with open(member.zip_path, "rb") as zip_file:
+            zip_file.seek(member.offset)
+            data: bytes = zip_file.read(member.file_size)
+
+        assert (
+            len(data) == member.file_size
+        ), f"{member.name} in {member.zip_path} is truncated"
+
+        return data
+
+    def buffer(self, member: ZipMember) -> Union[bytes, memoryview]:
+        """
+        The contents of a file as the zip stores them. For a file the zip stores uncompressed,
+        that is a view of a memory map of the zip at the file's offset, so nothing is read until
+        it is used, and nothing is copied. Otherwise, it is the bytes read from the zip.
+        """
+
+        if member.compress_type != zipfile.ZIP_STORED:
+            return self.read(member)
+
+        if member.zip_path not in self._maps:
+            with open(member.zip_path, "rb") as zip_file:
+                self._maps[member.zip_path] = mmap.mmap(
+                    zip_file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        zip_map: mmap.mmap = self._maps[member.zip_path]
+        assert member.offset + member.file_size <= len(
+            zip_map
+        ), f"{member.name} in {member.zip_path} is truncated"
+
+        return memoryview(zip_map)[member.offset : member.offset + member.file_size]
+
+    def close(self) -> None:
+        for zf in self._zips.values():
+            zf.close()
+        self._zips.clear()
+        for zip_map in self._maps.values():
+            try:
+                zip_map.close()
+            except BufferError:
+                pass  # Views of it are still in use: it is closed when they are released
+        self._maps.clear()
+
+
+_catalogs: Dict[str, Catalog] = dict()
+
+
+def load_catalog(zip_dir: str, *, rebuild: bool = False) -> Catalog:
+    """
+    The catalog of the zips in a directory: from memory, if it was loaded before;
+    else from the saved catalog (see catalog_path), if none of the zips have changed since it was saved;
+    else by scanning the zips (and saving the catalog, if it can be).
+    """
+
+    zip_dir = os.path.abspath(os.path.expanduser(zip_dir))
+    stamps: Dict[str, List[int]] = _zip_stamps(zip_dir)
+
+    catalog: Optional[Catalog] = _catalogs.get(zip_dir)
+    if catalog is not None and not rebuild and catalog.stamps == stamps:
+        return catalog
+
+    path: str = catalog_path(zip_dir)
+    saved: Optional[Dict[str, Any]] = None
+    if not rebuild and os.path.exists(path):
+        with open(path, "r") as catalog_file:
+            saved = json.load(catalog_file)
+        if saved.get("version") != _catalog_version or saved.get("zips") != stamps:
+            saved = None
+
+    if saved is None:
+        catalog = build_catalog(zip_dir)
+        try:
+            save_catalog(catalog)
+        except OSError:
+            pass  # A read-only zip directory: just keep the catalog in memory
+    else:
+        catalog = Catalog(
+            zip_dir,
+            {
+                tuple(row[:5]): ZipMember(os.path.join(zip_dir, row[5]), *row[6:])  # type: ignore
+                for row in saved["members"]
+            },
+            stamps,
+        )
+
+    _catalogs[zip_dir] = catalog
+
+    return catalog
+
+
+def build_catalog(zip_dir: str) -> Catalog:
+    """Scan the zips in a directory, and index the scores, by-district aggregates, and ensemble files in them."""
+
+    zip_dir = os.path.abspath(os.path.expanduser(zip_dir))
+    stamps: Dict[str, List[int]] = _zip_stamps(zip_dir)
+
+    # The state, chamber, and ensemble for the path of each ensemble directory in each zip:
+    # {xx}_{chamber}/{ensemble name}/ in the xx_chamber zips, and
+    # reversible.long/{xx}/{xx}_{chamber}/{ensemble name}/ in reversible.long.zip.
+    # The names are only distinct w/in a zip: "Rev*" and "Rev" have the same one.
+
+    ensemble_ids: Dict[Tuple[str, str], Tuple[str, str, str]] = dict()
+    for xx in states:
+        for chamber in chambers:
+            for e_id in ensembles:
+                ensemble_name: str = get_ensemble_name(xx, chamber, e_id)
+                zip_name: str
+                ensemble_dir: str
+                if e_id != "Rev":
+                    zip_name = f"{xx}_{chamber}.zip"
+                    ensemble_dir = f"{xx}_{chamber}/{ensemble_name}"
+                else:
+                    zip_name = "reversible.long.zip"
+                    ensemble_dir = (
+                        f"reversible.long/{xx}/{xx}_{chamber}/{ensemble_name}"
+                    )
+                assert (
+                    zip_name,
+                    ensemble_dir,
+                ) not in ensemble_ids, (
+                    f"Duplicate ensemble directory {ensemble_dir} in {zip_name}"
+                )
+                ensemble_ids[(zip_name, ensemble_dir)] = (xx, chamber, e_id)
+
+    members: Dict[CatalogKey, ZipMember] = dict()
+    for zip_name in _zip_names():
+        zip_path: str = os.path.join(zip_dir, zip_name)
+        if not os.path.exists(zip_path):
+            continue
+
+        with open(zip_path, "rb") as zip_file, zipfile.ZipFile(zip_file) as zf:
+            for info in zf.infolist():
+                # Just the files right in an ensemble's directory, named for its state & chamber,
+                # not, e.g., stray copies in __MACOSX/ or a nested backup
+                ensemble_dir, _, file_name = info.filename.rpartition("/")
+                if info.is_dir():
+                    continue
+                ids: Optional[Tuple[str, str, str]] = ensemble_ids.get(
+                    (zip_name, ensemble_dir)
+                )
+                if ids is None or not file_name.startswith(f"{ids[0]}_{ids[1]}_"):
+                    continue
+                match: Optional[re.Match] = _member_pattern.search(file_name)
+                if match is None:
+                    continue
+
+                kind: str = match.group("kind") or "ensemble"
+                category: Optional[str] = match.group("category")
+                if kind == "scores" and category not in metric_categories:
+                    continue
+                if kind == "bydistrict" and category not in aggregate_categories:
+                    continue
+
+                key: CatalogKey = (*ids, kind, category)
+                assert (
+                    key not in members
+                ), f"Duplicate {kind} file for {key} in {zip_path}"
+                members[key] = ZipMember(
+                    zip_path,
+                    info.filename,
+                    _data_offset(zip_file, info),
+                    info.compress_type,
+                    info.compress_size,
+                    info.file_size,
+                    info.CRC,
+                )
+
+    return Catalog(zip_dir, members, stamps)
+
+
+def save_catalog(catalog: Catalog) -> None:
+    """Save a catalog: in the cache directory, or as catalog.json in its zip directory (see catalog_path)."""
+
+    path: str = catalog_path(catalog.zip_dir)
+    rows: List[List[Any]] = [
+        [*key, os.path.relpath(member.zip_path, catalog.zip_dir), *member[1:]]
+        for key, member in catalog.members.items()
+    ]
+    tmp_path: str = f"{path}.{os.getpid()}.tmp"  # Builds in several processes may race
+    with open(tmp_path, "w") as catalog_file:
+        json.dump(
+            {"version": _catalog_version, "zips": catalog.stamps, "members": rows},
+            catalog_file,
+        )
+    os.replace(tmp_path, path)
+
+
+def catalog_path(zip_dir: str) -> str:
+    """The path of the catalog for the zips in a directory: in the cache directory, if the cache is enabled, else in the zip directory."""
+
+    # Imported here, as the cache imports ZipMember from this module
+    from .cache import cache_file_path
+
+    zip_dir = os.path.abspath(os.path.expanduser(zip_dir))
+    cached_path: Optional[str] = cache_file_path(
+        f"catalog-{hashlib.sha1(zip_dir.encode()).hexdigest()}.json"
+    )
+
+    return (
+        cached_path
+        if cached_path is not None
+        else os.path.join(zip_dir, "catalog.json")
+    )
+
+
+### HELPERS ###
+
+
+def _zip_names() -> List[str]:
+    """The names of the 22 zips."""
+
+    return [f"{xx}_{chamber}.zip" for xx in states for chamber in chambers] + [
+        "reversible.long.zip"
+    ]
+
+
+def _zip_stamps(zip_dir: str) -> Dict[str, List[int]]:
+    """The size & modification time of each zip in a directory, to tell if a catalog is stale."""
+
+    stamps: Dict[str, List[int]] = dict()
+    for zip_name in _zip_names():
+        zip_path: str = os.path.join(zip_dir, zip_name)
+        if os.path.exists(zip_path):
+            stat: os.stat_result = os.stat(zip_path)
+            stamps[zip_name] = [stat.st_size, stat.st_mtime_ns]
+
+    return stamps
+
+
+def _data_offset(zip_file: BinaryIO, info: zipfile.ZipInfo) -> int:
+    """The offset of a file's data in a zip: after its local header, which has its own name & extra field lengths."""
+
+    zip_file.seek(info.header_offset)
+    header: bytes = zip_file.read(zipfile.sizeFileHeader)
+    assert (
+        header[:4] == zipfile.stringFileHeader
+    ), f"Bad local header for {info.filename}"
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+
+    return info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
+
+
+### END ###
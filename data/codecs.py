@@ -0,0 +1,472 @@
+"""
+DECOMPRESSING THE FILES IN THE ZIPPED ENSEMBLES
+
+The files in the zips are xz-compressed (.xz), seekable zstd-compressed (.zst, see
+data-scripts/transcode_zstd.py), or not compressed at all (e.g., in reversible.long.zip).
+The codec is chosen by the file name's suffix, so loaders read all of them transparently.
+
+An xz file with several blocks (or several concatenated streams, see data-scripts/repack_xz.py)
+is decompressed a block at a time in a pool of threads: each block is re-wrapped as a
+single-block xz stream using the file's index, and liblzma releases the GIL while decoding.
+
+A seekable .zst file is a series of independent zstd frames, each holding whole lines,
+followed by a seek table in a skippable frame (the zstd "seekable format"). Any zstd decoder
+can decompress it whole -- as the loaders do -- and tools that support the format can use the
+seek table to decompress just some of the frames.
+
+Reading .zst files requires the zstandard package:
+    `pip install zstandard`
+"""
+
+from typing import BinaryIO, Deque, Iterator, List, Optional, Tuple, Union
+
+import io
+import os
+import lzma
+import zlib
+import struct
+import multiprocessing
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_skippable_magic: int = 0x184D2A5E  # The zstd skippable frame the seek table is in
+_seekable_magic: int = 0x8F92EAB1
+
+_xz_magic: bytes = b"\xfd7zXZ\x00"
+_xz_footer_magic: bytes = b"YZ"
+_xz_header_size: int = 12  # The stream header & footer are the same size
+
+# Stream header, start, stop, unpadded & uncompressed sizes
+XzBlock = Tuple[bytes, int, int, int, int]
+# E.g., a view of a file in a memory-mapped zip (see Catalog.buffer)
+Buffer = Union[bytes, memoryview]
+
+
+def decompress(name: str, data: Buffer) -> Buffer:
+    """Decompress the (whole) contents of a file, by its name's suffix. Uncompressed contents are returned as is."""
+
+    if name.endswith(".xz"):
+        return decompress_xz(data)
+    if name.endswith(".zst"):
+        with _zstd().ZstdDecompressor().stream_reader(
+            data, read_across_frames=True
+        ) as stream:
+            return stream.read()
+
+    return data
+
+
+def iter_lines(data: Buffer, *, window: int = 1 << 20) -> Iterator[memoryview]:
+    """
+    The lines in a file's (decompressed) contents, as views of them: nothing is copied.
+    The newlines are found a window (of window bytes) at a time, as the lines are used, so
+    e.g. only the pages of a memory-mapped file up to the current line are read.
+    """
+
+    view: memoryview = memoryview(data)
+
+    start: int = 0
+    for offset in range(0, len(view), window):
+        newlines: np.ndarray = np.flatnonzero(
+            np.frombuffer(view[offset : offset + window], dtype=np.uint8) == ord("\n")
+        )
+        for end in (newlines + offset).tolist():
+            yield view[start : end + 1]
+            start = end + 1
+    if start < len(view):
+        yield view[start:]
+
+
+def is_blank(line: Buffer) -> bool:
+    """Whether a line (or a view of one) is empty or all whitespace. Only a line that starts with whitespace is copied to check."""
+
+    return len(line) == 0 or (line[0] in b" \t\r\n" and not bytes(line).strip())
+
+
+def iter_decompressed_lines(
+    name: str, data: Buffer, *, chunk_size: int = 1 << 20
+) -> Iterator[Buffer]:
+    """
+    The lines in a file's contents (without their newlines), decompressed incrementally, by its
+    name's suffix: only a few chunks (or xz blocks) of the decompressed contents are in memory at once.
+    The lines of uncompressed contents are views of them (see iter_lines): nothing is copied.
+    """
+
+    if not name.endswith((".xz", ".zst")):
+        for line in iter_lines(data):
+            yield line[:-1] if line[-1] == ord("\n") else line
+        return
+
+    rest: bytes = b""
+    for chunk in iter_decompressed(name, data, chunk_size=chunk_size):
+        lines: List[bytes] = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+def iter_decompressed(
+    name: str, data: Buffer, *, chunk_size: int = 1 << 20
+) -> Iterator[bytes]:
+    """Decompress a file's contents a chunk (about chunk_size bytes) or an xz block at a time, by its name's suffix."""
+
+    if name.endswith(".xz"):
+        if len(xz_blocks(data) or []) > 1:
+            yield from iter_xz_blocks(data)
+        else:
+            yield from _iter_xz_chunks(data, chunk_size)
+        return
+    if name.endswith(".zst"):
+        with _zstd().ZstdDecompressor().stream_reader(
+            data, read_across_frames=True
+        ) as stream:
+            while chunk := stream.read(chunk_size):
+                yield chunk
+        return
+
+    yield bytes(data)
+
+
+def decompress_stream(name: str, stream: BinaryIO) -> BinaryIO:
+    """Wrap a stream of a file's contents in a stream that decompresses them, by its name's suffix."""
+
+    if name.endswith(".xz"):
+        data: bytes = stream.read()
+        if len(xz_blocks(data) or []) > 1:
+            return io.BufferedReader(_ChunkStream(iter_xz_blocks(data)))  # type: ignore
+        return lzma.LZMAFile(io.BytesIO(data))  # type: ignore
+    if name.endswith(".zst"):
+        return _zstd().ZstdDecompressor().stream_reader(stream, read_across_frames=True)  # type: ignore
+
+    return stream
+
+
+### SEEKABLE ZSTD ###
+
+
+class _PieceWriter(ABC):
+    """
+    Write a stream of lines in independently compressed pieces, each about piece_size bytes
+    of (whole) lines, so they can be decompressed separately.
+    """
+
+    def __init__(self, stream: BinaryIO, piece_size: int) -> None:
+        self.stream: BinaryIO = stream
+        self.piece_size: int = piece_size
+        # The compressed & decompressed sizes
+        self.pieces: List[Tuple[int, int]] = list()
+        self._pending: List[bytes] = list()
+        self._pending_size: int = 0
+
+    def write(self, line: bytes) -> None:
+        """Write a line (or several). Lines are never split across pieces."""
+
+        self._pending.append(line)
+        self._pending_size += len(line)
+        if self._pending_size >= self.piece_size:
+            self._flush_piece()
+
+    def close(self) -> None:
+        """Write the last piece."""
+
+        self._flush_piece()
+
+    @abstractmethod
+    def _compress(self, data: bytes) -> bytes:
+        """Compress a piece, independently of the others."""
+
+    def _flush_piece(self) -> None:
+        if not self._pending:
+            return
+
+        data: bytes = b"".join(self._pending)
+        piece: bytes = self._compress(data)
+        self.stream.write(piece)
+        self.pieces.append((len(piece), len(data)))
+        self._pending = list()
+        self._pending_size = 0
+
+
+class SeekableZstdWriter(_PieceWriter):
+    """
+    Write a stream of lines as seekable zstd: a frame per frame_size bytes of (whole) lines,
+    and a seek table at the end (by close).
+    """
+
+    def __init__(
+        self, stream: BinaryIO, *, level: int = 3, frame_size: int = 4 << 20
+    ) -> None:
+        super().__init__(stream, frame_size)
+        self.compressor = _zstd().ZstdCompressor(level=level, write_content_size=True)
+
+    def close(self) -> None:
+        """Write the last frame and the seek table."""
+
+        super().close()
+
+        entries: bytes = b"".join(
+            struct.pack("<II", compressed, decompressed)
+            for compressed, decompressed in self.pieces
+        )
+        footer: bytes = struct.pack("<IBI", len(self.pieces), 0, _seekable_magic)
+        self.stream.write(
+            struct.pack("<II", _skippable_magic, len(entries) + len(footer))
+        )
+        self.stream.write(entries + footer)
+
+    def _compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+
+### MULTI-BLOCK XZ ###
+
+
+class XzBlocksWriter(_PieceWriter):
+    """
+    Write a stream of lines as multi-block xz: a single-block xz stream per block_size bytes
+    of (whole) lines, concatenated. Any xz decoder reads the result as one file.
+    """
+
+    def __init__(
+        self, stream: BinaryIO, *, preset: int = 6, block_size: int = 4 << 20
+    ) -> None:
+        super().__init__(stream, block_size)
+        self.preset: int = preset
+
+    def _compress(self, data: bytes) -> bytes:
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=self.preset)
+
+
+def decompress_xz(data: Buffer, *, threads: Optional[int] = None) -> bytes:
+    """Decompress xz data, with its blocks decompressed in parallel if there are several."""
+
+    return b"".join(iter_xz_blocks(data, threads=threads))
+
+
+def iter_xz_blocks(data: Buffer, *, threads: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Decompress xz data a block at a time, in order, in a pool of threads (by default, one per core,
+    or just one in a worker process, e.g., of a build with --jobs N, so the cores aren't oversubscribed).
+    At most 2 x threads blocks are in flight at a time. Data with just one block -- or that can't
+    be split into blocks -- is decompressed whole.
+    """
+
+    threads = threads or _default_threads()
+    blocks: Optional[List[XzBlock]] = xz_blocks(data)
+    if blocks is None or len(blocks) <= 1:
+        yield lzma.decompress(data)
+        return
+    if threads <= 1:
+        for block in blocks:
+            yield lzma.decompress(_xz_block_stream(data, block))
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending: Deque[Future] = deque()
+        for block in blocks:
+            pending.append(pool.submit(lzma.decompress, _xz_block_stream(data, block)))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def xz_blocks(data: Buffer) -> Optional[List[XzBlock]]:
+    """
+    Find the blocks in xz data -- in one or more concatenated streams -- from the streams' indexes,
+    reading back from the end. Returns None if the data isn't well-formed xz.
+    """
+
+    blocks: List[XzBlock] = list()
+    pos: int = len(data)
+    try:
+        while pos > 0:
+            while pos >= 4 and data[pos - 4 : pos] == b"\x00\x00\x00\x00":
+                pos -= 4  # Stream padding
+
+            footer: bytes = data[pos - _xz_header_size : pos]
+            if len(footer) < _xz_header_size or footer[10:12] != _xz_footer_magic:
+                return None
+            backward_size: int = (struct.unpack("<I", footer[4:8])[0] + 1) * 4
+            index_start: int = pos - _xz_header_size - backward_size
+
+            records: List[Tuple[int, int]] = _xz_index(data, index_start, backward_size)
+            stream_start: int = (
+                index_start
+                - sum(_xz_padded(unpadded) for unpadded, _ in records)
+                - _xz_header_size
+            )
+            header: bytes = bytes(data[stream_start : stream_start + _xz_header_size])
+            if (
+                stream_start < 0
+                or header[:6] != _xz_magic
+                or header[6:8] != footer[8:10]
+            ):
+                return None
+
+            stream_blocks: List[XzBlock] = list()
+            start: int = stream_start + _xz_header_size
+            for unpadded, uncompressed in records:
+                stop: int = start + _xz_padded(unpadded)
+                stream_blocks.append((header, start, stop, unpadded, uncompressed))
+                start = stop
+
+            blocks[:0] = stream_blocks
+            pos = stream_start
+    except (IndexError, struct.error):
+        return None
+
+    return blocks
+
+
+### HELPERS ###
+
+
+def _iter_xz_chunks(data: Buffer, chunk_size: int) -> Iterator[bytes]:
+    """Decompress xz data -- one or more concatenated streams -- incrementally, at most chunk_size bytes at a time."""
+
+    view: memoryview = memoryview(data)
+    pos: int = 0
+    while pos < len(view):
+        decompressor: lzma.LZMADecompressor = lzma.LZMADecompressor()
+        while not decompressor.eof:
+            compressed: Buffer = b""
+            if decompressor.needs_input:
+                if pos >= len(view):
+                    raise lzma.LZMAError("Truncated xz data")
+                compressed = view[pos : pos + chunk_size]
+                pos += len(compressed)
+            chunk: bytes = decompressor.decompress(compressed, max_length=chunk_size)
+            if chunk:
+                yield chunk
+
+        pos -= len(decompressor.unused_data)
+        while pos < len(view) and view[pos] == 0:
+            pos += 1  # Stream padding
+
+
+def _default_threads() -> int:
+    """One thread per core, or one in a worker process, which already has its share of the cores."""
+
+    if multiprocessing.parent_process() is not None:
+        return 1
+
+    return os.cpu_count() or 1
+
+
+class _ChunkStream(io.RawIOBase):
+    """A readable stream over an iterator of byte strings."""
+
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self.chunks: Iterator[bytes] = chunks
+        self.chunk: memoryview = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:  # type: ignore
+        while not self.chunk:
+            next_chunk: Optional[bytes] = next(self.chunks, None)
+            if next_chunk is None:
+                return 0
+            self.chunk = memoryview(next_chunk)
+
+        n: int = min(len(buffer), len(self.chunk))
+        buffer[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+
+        return n
+
+
+def _xz_index(data: Buffer, start: int, size: int) -> List[Tuple[int, int]]:
+    """Read the (unpadded size, uncompressed size) records of the blocks in an xz stream's index."""
+
+    if start < 0 or data[start] != 0:
+        raise IndexError("No xz index")
+
+    pos: int = start + 1
+    n_records, pos = _varint(data, pos)
+    records: List[Tuple[int, int]] = list()
+    for _ in range(n_records):
+        unpadded, pos = _varint(data, pos)
+        uncompressed, pos = _varint(data, pos)
+        records.append((unpadded, uncompressed))
+
+    if pos > start + size - 4:
+        raise IndexError("Bad xz index")
+
+    return records
+
+
+def _xz_block_stream(data: Buffer, block: XzBlock) -> bytes:
+    """Wrap a block of xz data as a single-block xz stream, with its own index & footer."""
+
+    header, start, stop, unpadded, uncompressed = block
+
+    index: bytes = (
+        b"\x00" + _to_varint(1) + _to_varint(unpadded) + _to_varint(uncompressed)
+    )
+    index += b"\x00" * (-len(index) % 4)
+    index += struct.pack("<I", zlib.crc32(index))
+
+    flags: bytes = header[6:8]
+    backward: bytes = struct.pack("<I", len(index) // 4 - 1) + flags
+    footer: bytes = (
+        struct.pack("<I", zlib.crc32(backward)) + backward + _xz_footer_magic
+    )
+
+    return header + data[start:stop] + index + footer
+
+
+def _xz_padded(unpadded: int) -> int:
+    """The size of an xz block with its padding, to a multiple of 4 bytes."""
+
+    return (unpadded + 3) // 4 * 4
+
+
+def _varint(data: Buffer, pos: int) -> Tuple[int, int]:
+    """Read a variable-length integer (as in xz indexes). Returns it and the position after it."""
+
+    value: int = 0
+    shift: int = 0
+    while True:
+        byte: int = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _to_varint(value: int) -> bytes:
+    """Write a variable-length integer (as in xz indexes)."""
+
+    encoded: bytearray = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+
+    return bytes(encoded)
+
+
+def _zstd():
+    """The zstandard module, which is only needed for .zst files."""
+
+    if zstandard is None:
+        raise ImportError(
+            "Reading or writing .zst files requires: pip install zstandard"
+        )
+
+    return zstandard
+
+
+### END ###
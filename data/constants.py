@@ -30,6 +30,15 @@ ensembles: List[str] = [
     "R100",
 ]
 
+# The number of plans in each ensemble
+plans_per_ensemble: int = 20000
+
+### SCORES ###
+
+# The columns that identify the state, chamber, and ensemble of each plan in the scores,
+# in the order the scores are sorted and partitioned by
+scores_keys: List[str] = ["state", "chamber", "ensemble"]
+
 ### METRICS ###
 
 # The plan-level metrics computed for each ensemble, by category and individually.
@@ -95,6 +104,18 @@ metrics: List[str] = [
     metric for category in metrics_by_category.values() for metric in category
 ]
 
+# The metrics that count plans' districts, splits, etc. (whole numbers)
+count_metrics: List[str] = [
+    "fptp_seats",
+    "competitive_district_count",
+    "mmd_black",
+    "mmd_hispanic",
+    "mmd_coalition",
+    "cut_score",
+    "counties_split",
+    "county_splits",
+]
+
 ### AGGREGATES ###
 
 # The by-district aggregates computed for each ensemble, by category and individually.
@@ -0,0 +1,108 @@
+"""
+DECODING THE JSON RECORDS IN THE ZIPPED ENSEMBLES
+
+After decompression, parsing the JSONL records a line at a time is the bulk of the work of loading
+the by-district aggregates and the ensembles. The records are decoded with the fastest JSON library
+installed -- orjson, then msgspec, then the standard library's json -- so the loaders get faster just
+by installing one of them:
+    `pip install orjson`
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+from .codecs import Buffer
+
+# Dataset type -> dataset -> aggregate -> values
+ByDistrict = Dict[str, Dict[str, Dict[str, List[Any]]]]
+
+json_backends: List[str] = ["orjson", "msgspec", "json"]
+
+
+def _json_loads(data: Union[Buffer, str]) -> Any:
+    return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj).encode()
+
+
+def _loads_for(backend: str) -> Callable[[Union[Buffer, str]], Any]:
+    if backend == "orjson":
+        assert orjson is not None, "orjson is not installed"
+        return orjson.loads
+    if backend == "msgspec":
+        assert msgspec is not None, "msgspec is not installed"
+        return msgspec.json.Decoder().decode
+
+    return _json_loads
+
+
+def _dumps_for(backend: str) -> Callable[[Any], bytes]:
+    if backend == "orjson":
+        assert orjson is not None, "orjson is not installed"
+        return orjson.dumps
+    if backend == "msgspec":
+        assert msgspec is not None, "msgspec is not installed"
+        return msgspec.json.encode
+
+    return _json_dumps
+
+
+json_backend: str = "orjson" if orjson else "msgspec" if msgspec else "json"
+_loads: Callable[[Union[Buffer, str]], Any] = _loads_for(json_backend)
+_dumps: Callable[[Any], bytes] = _dumps_for(json_backend)
+
+
+def set_json_backend(backend: str) -> None:
+    """Use a specific JSON library, e.g., "json" to compare it with the default."""
+
+    global json_backend, _loads, _dumps
+
+    assert backend in json_backends, f"Invalid JSON backend: {backend}"
+    _loads = _loads_for(backend)
+    _dumps = _dumps_for(backend)
+    json_backend = backend
+
+
+def loads(data: Union[Buffer, str]) -> Any:
+    """Decode a JSON record (e.g., a line of a JSONL file) from bytes, a view of them, or a string."""
+
+    return _loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode an object as JSON, e.g., records to cache (see data/cache.py)."""
+
+    return _dumps(obj)
+
+
+### BY-DISTRICT RECORDS ###
+
+
+def decode_by_district(
+    data: Union[Buffer, str]
+) -> Tuple[str, Any, Optional[ByDistrict]]:
+    """
+    Decode a record of a by-district JSONL file into its tag ("metadata" or "by-district"),
+    the plan name, and the by-district aggregates.
+    """
+
+    record: Any = _loads(data)
+    assert "_tag_" in record, "Record does not contain '_tag_' key"
+
+    return record["_tag_"], record.get("name"), record.get("by-district")
+
+
+### END ###
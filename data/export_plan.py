@@ -7,15 +7,16 @@ EXTRACT A PLAN FROM AN ENSEMBLE TO ASSIGNMENT FILE CSV
 import argparse
 from argparse import ArgumentParser, Namespace
 
-from typing import Any, List, Dict, TextIO, Tuple, Generator
+from typing import Any, List, Dict, Optional, TextIO, Tuple, Generator
 
-import os, json, zipfile, lzma, tempfile, subprocess
+import os, json, tempfile, subprocess
 from pathlib import Path
 
-from rdapy import read_record
-
 from data.constants import states, chambers, ensembles
-from data.filenames import get_ensemble_name
+from data.catalog import Catalog, ZipMember, load_catalog
+from data.codecs import Buffer, decompress
+from data.cache import load_cached_bytes, save_cached_bytes
+from data.decoding import loads
 from data.helpers import _decode_bytes
 
 
@@ -28,25 +29,20 @@ def main() -> None:
     assert args.chamber in chambers, f"Invalid chamber: {args.chamber}"
     assert args.ensemble in ensembles, f"Invalid ensemble: {args.ensemble}"
 
-    # Load the ensemble from the xz file w/in the zip file
-
-    zip_path: str = f"{args.input_dir}/{args.xx}_{args.chamber}.zip"
-    zip_path = os.path.expanduser(zip_path)
+    # Load the ensemble from the xz (or zstd) file w/in the zip file, found through the catalog of the zips,
+    # or from the cache of decompressed files, if it is enabled (see data/cache.py)
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        with zipfile.ZipFile(zip_path) as zf:
-            ensemble_name: str = get_ensemble_name(args.xx, args.chamber, args.ensemble)
-            ensemble_path: str = (
-                f"{args.xx}_{args.chamber}/{ensemble_name}/{ensemble_name}_ensemble.jsonl.xz"
-            )
+    catalog: Catalog = load_catalog(args.input_dir)
+    ensemble_file: ZipMember = catalog.member(
+        args.xx, args.chamber, args.ensemble, "ensemble"
+    )
 
-            if args.ensemble != "Rev":
-                xz_data = zf.read(ensemble_path)
-                ensemble_data = lzma.decompress(xz_data)
-            else:
-                ensemble_data = zf.read(ensemble_path)
+    ensemble_data: Optional[Buffer] = load_cached_bytes(ensemble_file)
+    if ensemble_data is None:
+        ensemble_data = decompress(ensemble_file.name, catalog.buffer(ensemble_file))
+        save_cached_bytes(ensemble_file, ensemble_data)
 
-            json_objects: List[Dict[str, Any]] = _decode_bytes(ensemble_data)
+    json_objects: List[Dict[str, Any]] = _decode_bytes(ensemble_data)
 
     # Serialize the JSON objects to a temp file
 
@@ -123,8 +119,9 @@ def ensemble_plans(
 
     for i, line in enumerate(ensemble_stream):
         try:
-            # Skip the metadata and ReCom graph records
-            in_record: Dict[str, Any] = read_record(line)
+            # Skip the metadata and ReCom graph records.
+            # Like rdapy's read_record -- json.loads(line.strip()) -- as JSON allows the surrounding whitespace.
+            in_record: Dict[str, Any] = loads(line)
             if "_tag_" not in in_record:
                 continue
             if in_record["_tag_"] == "metadata":
@@ -2,47 +2,306 @@
 HELPERS FOR WORKING WITH SCORES AND BY-DISTRICT AGGREGATES
 """
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Union, Tuple, Generator
 
-import os, json
+import os, zlib
 import numpy as np
 import pandas as pd
-import zipfile
-import fnmatch
-import lzma
-import tempfile
+import pyarrow.parquet as pq
 
 from .constants import (
     states,
     chambers,
     ensembles,
+    plans_per_ensemble,
+    scores_keys,
     metrics,
+    count_metrics,
     aggregates,
+    aggregates_by_category,
     aggregate_categories,
     datasets_by_aggregate_category,
 )
-from .filenames import get_ensemble_name
+from .catalog import Catalog, ZipMember, load_catalog
+from .aggstore import StoredAggregates
+from .cache import (
+    cache_enabled,
+    load_cached_arrays,
+    save_cached_arrays,
+    load_cached_bytes,
+    save_cached_bytes,
+)
+from .decoding import ByDistrict, decode_by_district, dumps, loads
+from .codecs import (
+    Buffer,
+    is_blank,
+    iter_decompressed_lines,
+    iter_lines,
+)
+from .indexes import (
+    ScoresIndex,
+    LazyScores,
+    ArrowScores,
+    _row_group_keys,
+    _key_runs,
+    _group_slices,
+)
 
 ### SCORES ###
 
 
-def load_scores(scores_path: str) -> pd.DataFrame:
-    """Read the scores .parquet file into a DataFrame."""
+def load_scores(
+    scores_path: str,
+    *,
+    states: Optional[List[str]] = None,
+    chambers: Optional[List[str]] = None,
+    ensembles: Optional[List[str]] = None,
+    columns: Optional[List[str]] = None,
+    compact: bool = False,
+    float32: bool = False,
+) -> pd.DataFrame:
+    """
+    Read the scores .parquet file into a DataFrame.
+    Optionally, only read the rows for the given states, chambers, and/or ensembles and only the given metrics.
+    The filters are pushed down to pyarrow, so for a scores file written by make_scores_df.py
+    (one row group per state, chamber, and ensemble) only the matching row groups are read.
+    The plan ("map") and state, chamber, and ensemble columns are always included.
+    With compact=True, the scores use compact dtypes (see compact_scores).
+    """
+
+    df: pd.DataFrame = pd.read_parquet(
+        os.path.expanduser(scores_path),
+        columns=_scores_columns(columns),
+        filters=_scores_filters(states, chambers, ensembles),
+    )
 
-    df: pd.DataFrame = pd.read_parquet(os.path.expanduser(scores_path))
+    if compact:
+        df = compact_scores(df, float32=float32)
 
     return df
 
 
+def sample_scores(
+    scores_path: str,
+    *,
+    per_group: int = 500,
+    seed: int = 0,
+    columns: Optional[List[str]] = None,
+    states: Optional[List[str]] = None,
+    chambers: Optional[List[str]] = None,
+    ensembles: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read a reproducible, stratified sample of (at most) per_group plans for each state, chamber, and ensemble.
+    The sample for a combination only depends on the seed, the combination, and its plans (in "map" order).
+    The optional filters are the same as for load_scores. For a scores file written by make_scores_df.py,
+    only the row groups for the selected combinations are read, one combination at a time.
+    """
+
+    scores_file: pq.ParquetFile = pq.ParquetFile(os.path.expanduser(scores_path))
+    read_columns: Optional[List[str]] = _scores_columns(columns)
+    filters: Optional[List[tuple]] = _scores_filters(states, chambers, ensembles)
+    selected: List[Optional[List[str]]] = [
+        None if values is None else list(values)
+        for values in [states, chambers, ensembles]
+    ]
+
+    samples: List[pd.DataFrame] = list()
+
+    row_group_keys: Optional[List[Tuple[str, str, str]]] = _row_group_keys(scores_file)
+    if row_group_keys is not None:
+        for key in dict.fromkeys(row_group_keys):
+            if not all(s is None or k in s for k, s in zip(key, selected)):
+                continue
+            row_groups: List[int] = [
+                i for i, k in enumerate(row_group_keys) if k == key
+            ]
+            table = scores_file.read_row_groups(row_groups, columns=read_columns)
+            rows: np.ndarray = _sample_rows(key, table.num_rows, per_group, seed)
+            samples.append(table.take(rows).to_pandas())
+    else:
+        df: pd.DataFrame = pd.read_parquet(
+            os.path.expanduser(scores_path), columns=read_columns, filters=filters
+        )
+        df = df.sort_values(by=scores_keys + ["map"], kind="stable")
+        slices: Optional[Dict[Tuple[str, str, str], slice]] = _group_slices(df)
+        assert slices is not None, "Sorted scores are not grouped contiguously"
+        for key, group in slices.items():
+            group_df: pd.DataFrame = df.iloc[group]
+            rows = _sample_rows(key, len(group_df), per_group, seed)
+            samples.append(group_df.iloc[rows])
+
+    if not samples:
+        return pd.read_parquet(
+            os.path.expanduser(scores_path), columns=read_columns, filters=filters
+        )
+
+    sample_df: pd.DataFrame = pd.concat(samples, ignore_index=True)
+
+    return sample_df
+
+
+def validate_scores(
+    scores: pd.DataFrame, *, expected_plans: int = plans_per_ensemble
+) -> pd.DataFrame:
+    """
+    Validate the scores in a single groupby pass.
+    Returns a report with a row for each state, chamber, and ensemble combination (including any that are missing)
+    with the number of plans, the expected number of plans, the number of NaN values for each metric, and
+    whether the combination is "ok" -- i.e., it has the expected number of plans and no metric is all NaN.
+    """
+
+    grouped = scores.groupby(scores_keys, observed=True, sort=False)
+    plans: pd.Series = grouped.size()
+    present: List[str] = [m for m in metrics if m in scores.columns]
+    nans: pd.DataFrame = grouped[present].count().rsub(plans, axis=0)
+    for metric in [m for m in metrics if m not in scores.columns]:
+        nans[metric] = plans  # A missing metric is all NaN
+
+    combos: pd.MultiIndex = pd.MultiIndex.from_product(
+        [states, chambers, ensembles], names=scores_keys
+    )
+    report: pd.DataFrame = pd.concat(
+        [plans.rename("plans"), nans[metrics]], axis=1
+    ).reindex(combos, fill_value=0)
+    report.insert(1, "expected", expected_plans)
+
+    all_nan: pd.Series = report[metrics].eq(report["plans"], axis=0).any(axis=1) & (
+        report["plans"] > 0
+    )
+    report["ok"] = (report["plans"] == report["expected"]) & ~all_nan
+
+    return report
+
+
+def compact_scores(
+    df: pd.DataFrame,
+    *,
+    float32: bool = False,
+    count_types: Optional[Dict[str, Any]] = None,
+) -> pd.DataFrame:
+    """
+    Convert the scores to compact dtypes, to cut resident memory:
+    - The state, chamber, and ensemble columns become categoricals (in the order of the constants);
+    - The plan ids ("map") become int32; and
+    - The count metrics become the smallest int type that holds them, if they are all whole numbers.
+    Optionally, the other (real-valued) metrics become float32.
+    To convert batches of the scores consistently, pass the types for the count metrics.
+    """
+
+    compacted: pd.DataFrame = df.copy()
+
+    for key, values in zip(scores_keys, [states, chambers, ensembles]):
+        compacted[key] = compacted[key].astype(pd.CategoricalDtype(values))
+
+    plans: np.ndarray = compacted["map"].to_numpy()
+    if np.issubdtype(plans.dtype, np.integer) and (
+        plans.size == 0 or plans.max() <= np.iinfo(np.int32).max
+    ):
+        compacted["map"] = plans.astype(np.int32)
+
+    for metric in [m for m in metrics if m in compacted.columns]:
+        values: np.ndarray = compacted[metric].to_numpy()
+        if metric in count_metrics:
+            values = values.astype(
+                count_types[metric]
+                if count_types is not None
+                else _count_type(values, np.float32 if float32 else values.dtype)
+            )
+        elif float32:
+            values = values.astype(np.float32)
+        compacted[metric] = values
+
+    return compacted
+
+
+def load_arrow_scores(
+    scores_path: str,
+    *,
+    states: Optional[List[str]] = None,
+    chambers: Optional[List[str]] = None,
+    ensembles: Optional[List[str]] = None,
+    columns: Optional[List[str]] = None,
+) -> ArrowScores:
+    """
+    Read the scores .parquet file into a pyarrow Table, for zero-copy arrays from arr_from_scores.
+    The optional filters are the same as for load_scores.
+    """
+
+    table = pq.read_table(
+        os.path.expanduser(scores_path),
+        columns=_scores_columns(columns),
+        filters=_scores_filters(states, chambers, ensembles),
+    )
+
+    return ArrowScores(table)
+
+
+def iter_scores(
+    scores_path: str,
+    *,
+    columns: Optional[List[str]] = None,
+    batch_rows: int = 65536,
+    states: Optional[List[str]] = None,
+    chambers: Optional[List[str]] = None,
+    ensembles: Optional[List[str]] = None,
+) -> Generator[Tuple[Tuple[str, str, str], pd.DataFrame], None, None]:
+    """
+    Stream the scores .parquet file in batches of at most batch_rows rows, with bounded memory.
+    Each batch is tagged with its (state, chamber, ensemble) combination; a batch never spans two combinations.
+    The optional filters are the same as for load_scores. For a scores file written by make_scores_df.py,
+    the row groups for other combinations are skipped without being read.
+    """
+
+    scores_file: pq.ParquetFile = pq.ParquetFile(os.path.expanduser(scores_path))
+    read_columns: Optional[List[str]] = _scores_columns(columns)
+    selected: List[Optional[List[str]]] = [
+        None if values is None else list(values)
+        for values in [states, chambers, ensembles]
+    ]
+    _scores_filters(states, chambers, ensembles)  # Just to validate them
+
+    def is_selected(key: Tuple[str, str, str]) -> bool:
+        return all(s is None or k in s for k, s in zip(key, selected))
+
+    row_group_keys: Optional[List[Tuple[str, str, str]]] = _row_group_keys(scores_file)
+
+    for i in range(scores_file.metadata.num_row_groups):
+        if row_group_keys is not None and not is_selected(row_group_keys[i]):
+            continue
+
+        for batch in scores_file.iter_batches(
+            batch_size=batch_rows, row_groups=[i], columns=read_columns
+        ):
+            df: pd.DataFrame = batch.to_pandas()
+            keys: pd.DataFrame = df[scores_keys]
+            starts, stops = _key_runs(keys)
+
+            for start, stop in zip(starts, stops):
+                key: Tuple[str, str, str] = tuple(keys.iloc[start])  # type: ignore
+                if is_selected(key):
+                    yield key, df.iloc[start:stop]
+
+
 def df_from_scores(
-    xx: str, chamber: str, ensemble: str, scores: pd.DataFrame
+    xx: str,
+    chamber: str,
+    ensemble: str,
+    scores: Union[pd.DataFrame, ScoresIndex, LazyScores, ArrowScores],
 ) -> pd.DataFrame:
-    """Subset the scores DataFrame for a state, chamber, and ensemble combination."""
+    """
+    Subset the scores DataFrame for a state, chamber, and ensemble combination.
+    For repeated lookups, pass a ScoresIndex of the scores: the subset is then an O(1) slice (a view).
+    For LazyScores, just the combination is read from the scores file.
+    """
 
     assert xx in states, f"Invalid state: {xx}"
     assert chamber in chambers, f"Invalid chamber: {chamber}"
     assert ensemble in ensembles, f"Invalid ensemble: {ensemble}"
 
+    if not isinstance(scores, pd.DataFrame):
+        return scores.frame(xx, chamber, ensemble)
+
     subset_df: pd.DataFrame = scores[
         (scores["state"] == xx)
         & (scores["chamber"] == chamber)
@@ -53,15 +312,27 @@ def df_from_scores(
 
 
 def arr_from_scores(
-    xx: str, chamber: str, ensemble: str, metric: str, scores: pd.DataFrame
+    xx: str,
+    chamber: str,
+    ensemble: str,
+    metric: str,
+    scores: Union[pd.DataFrame, ScoresIndex, LazyScores, ArrowScores],
 ) -> np.ndarray:
-    """Extract a metric for a state, chamber, and ensemble combination from the scores DataFrame into a numpy array."""
+    """
+    Extract a metric for a state, chamber, and ensemble combination from the scores DataFrame into a numpy array.
+    For repeated lookups, pass a ScoresIndex of the scores: the array is then an O(1) slice (a view).
+    To only read the metrics that are used from the scores file, pass LazyScores.
+    For zero-copy views of the Arrow column buffers, pass ArrowScores (see load_arrow_scores).
+    """
 
     assert xx in states, f"Invalid state: {xx}"
     assert chamber in chambers, f"Invalid chamber: {chamber}"
     assert ensemble in ensembles, f"Invalid ensemble: {ensemble}"
     assert metric in metrics, f"Invalid metric: {metric}"
 
+    if not isinstance(scores, pd.DataFrame):
+        return scores.array(xx, chamber, ensemble, metric)
+
     arr: np.ndarray = scores[
         (scores["state"] == xx)
         & (scores["chamber"] == chamber)
@@ -83,66 +354,114 @@ def load_aggregates(
     *,
     minority_dataset: str = "vap",
 ) -> List[Dict[str, Any]]:
+    """
+    Load the by-district aggregates in a category for a state, chamber, and ensemble:
+    a record per plan, with its name and its aggregates. Pass it to arr_from_aggregates.
+    """
 
     assert xx in states, f"Invalid state: {xx}"
     assert chamber in chambers, f"Invalid chamber: {chamber}"
     assert ensemble in ensembles, f"Invalid ensemble: {ensemble}"
     assert category in aggregate_categories, f"Invalid aggregates category: {category}"
+    assert (
+        category != "minority"
+        or minority_dataset in datasets_by_aggregate_category["minority"]
+    ), f"Invalid minority dataset: {minority_dataset}"
+
+    # Find the bydistrict file in the zips through the catalog (see data/catalog.py)
 
-    zip_path: str = (
-        f"{zip_dir}/{xx}_{chamber}.zip"
-        if ensemble != "Rev"
-        else f"{zip_dir}/reversible.long.zip"
+    catalog: Catalog = load_catalog(zip_dir)
+    aggs_file: ZipMember = catalog.member(xx, chamber, ensemble, "bydistrict", category)
+
+    # With the cache enabled (see data/cache.py), decode all the aggregates in the category once,
+    # and serve them from the cache after that
+
+    if cache_enabled():
+        return _cached_records(catalog, aggs_file, category, minority_dataset)
+
+    # Decompress it incrementally & parse it a line at a time, keeping just the extracted aggregates.
+    # A file the zip stores uncompressed is read as a view of the memory-mapped zip (see Catalog.buffer).
+
+    aggregate_data: List[Dict[str, Any]] = _extract_aggregates(
+        _iter_records(aggs_file.name, catalog.buffer(aggs_file)),
+        category,
+        minority_dataset,
     )
-    zip_path = os.path.expanduser(zip_path)
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        with zipfile.ZipFile(zip_path) as zf:
+    return aggregate_data
 
-            ensemble_name: str = get_ensemble_name(xx, chamber, ensemble)
 
-            aggregates_pattern: str = f"*_{category}_bydistrict.jsonl"
-            if ensemble != "Rev":
-                aggregates_pattern = f"{xx}_{chamber}/{ensemble_name}/{xx}_{chamber}_{aggregates_pattern}.xz"
-            else:
-                aggregates_pattern = f"reversible.long/{xx}/{xx}_{chamber}/{ensemble_name}/{xx}_{chamber}_{aggregates_pattern}"
+def load_aggregate_arrays(
+    xx: str,
+    chamber: str,
+    ensemble: str,
+    category: str,
+    zip_dir: str,
+    aggregates: Optional[List[str]] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Like load_aggregates, but extract the aggregates in the category (or just the given ones)
+    straight into 2D plans x districts arrays (with the statewide values in column 0) while parsing,
+    keyed by aggregate, along with the plan "name"s. For the minority category, that is both
+    the VAP and CVAP aggregates, in one pass. Pass it to arr_from_aggregates.
+    """
 
-            zipped_files: List[str] = zf.namelist()
-            zipped_files = [
-                f for f in zipped_files if fnmatch.fnmatch(f, aggregates_pattern)
-            ]
-            assert (
-                len(zipped_files) == 1
-            ), f"Expected 1 {category} bydistrict file, found {len(zipped_files)}"
-            aggs_file: str = zipped_files[0]
+    assert xx in states, f"Invalid state: {xx}"
+    assert chamber in chambers, f"Invalid chamber: {chamber}"
+    assert ensemble in ensembles, f"Invalid ensemble: {ensemble}"
+    assert category in aggregate_categories, f"Invalid aggregates category: {category}"
+    for aggregate in aggregates or []:
+        assert (
+            aggregate in aggregates_by_category[category]
+        ), f"Invalid {category} aggregate: {aggregate}"
 
-            if ensemble != "Rev":
-                xz_data = zf.read(aggs_file)
-                agg_data = lzma.decompress(xz_data)
-            else:
-                agg_data = zf.read(aggs_file)
+    catalog: Catalog = load_catalog(zip_dir)
+    aggs_file: ZipMember = catalog.member(xx, chamber, ensemble, "bydistrict", category)
+    selected: List[str] = list(
+        aggregates if aggregates is not None else aggregates_by_category[category]
+    )
 
-            json_objects: List[Dict[str, Any]] = _decode_bytes(agg_data)
+    if cache_enabled():
+        cached: Dict[str, np.ndarray] = _cached_aggregate_arrays(
+            catalog, aggs_file, category
+        )
+        return {agg: cached[agg] for agg in ["name"] + selected}
 
-            aggregate_data: List[Dict[str, Any]] = _extract_aggregates(
-                json_objects, category, minority_dataset
-            )
+    aggregate_arrays: Dict[str, np.ndarray]
+    aggregate_arrays, _ = _extract_aggregate_arrays(
+        _iter_by_district(aggs_file.name, catalog.buffer(aggs_file)),
+        category,
+        selected,
+    )
 
-    return aggregate_data
+    return aggregate_arrays
 
 
 def arr_from_aggregates(
     aggregate: str,
-    loaded_aggregates: List[Dict[str, Any]],
+    loaded_aggregates: Union[
+        List[Dict[str, Any]], Dict[str, np.ndarray], StoredAggregates
+    ],
     *,
     include_statewide: bool = False,
 ) -> np.ndarray:
     """
     Extract an aggregrate the loaded aggregates for a state, chamber, ensemble, and aggregate category.
     Returns a 2D numpy array where each row corresponds to a plan and each column corresponds to a district.
+    The loaded aggregates can also be arrays (see load_aggregate_arrays) or
+    from an aggregates store (see load_stored_aggregates).
     """
 
     assert aggregate in aggregates, f"Invalid aggregate: {aggregate}"
+    if isinstance(loaded_aggregates, StoredAggregates):
+        return loaded_aggregates.array(aggregate, include_statewide=include_statewide)
+    if isinstance(loaded_aggregates, dict):
+        assert (
+            aggregate in loaded_aggregates
+        ), f"Aggregate {aggregate} not found in loaded aggregates"
+        arr: np.ndarray = loaded_aggregates[aggregate]
+        return arr if include_statewide else arr[:, 1:]
+
     assert (
         aggregate in loaded_aggregates[0]
     ), f"Aggregate {aggregate} not found in loaded aggregates"
@@ -156,16 +475,95 @@ def arr_from_aggregates(
 ### HELPERS ###
 
 
-def _decode_bytes(bytes: bytes) -> List[Dict[str, Any]]:
-    """Decode the bytes from a zipped by-district JSONL file."""
+def _scores_filters(
+    xx_list: Optional[List[str]],
+    chamber_list: Optional[List[str]],
+    ensemble_list: Optional[List[str]],
+) -> Optional[List[tuple]]:
+    """Make pyarrow filters that select the given states, chambers, and ensembles from the scores."""
+
+    filters: List[tuple] = list()
+    for key, values, valid in zip(
+        scores_keys,
+        [xx_list, chamber_list, ensemble_list],
+        [states, chambers, ensembles],
+    ):
+        if values is None:
+            continue
+        for value in values:
+            assert value in valid, f"Invalid {key}: {value}"
+        filters.append((key, "in", list(values)))
 
-    json_objects = [
-        json.loads(line) for line in bytes.decode("utf-8").strip().split("\n") if line
-    ]
+    return filters if filters else None
+
+
+def _scores_columns(columns: Optional[List[str]]) -> Optional[List[str]]:
+    """Add the plan id and state, chamber, and ensemble columns to a list of metrics to read."""
+
+    if columns is None:
+        return None
+
+    selected: List[str] = [m for m in columns if m not in ["map"] + scores_keys]
+    for metric in selected:
+        assert metric in metrics, f"Invalid metric: {metric}"
+
+    return ["map"] + selected + scores_keys
+
+
+def _sample_rows(
+    key: Tuple[str, str, str], n: int, per_group: int, seed: int
+) -> np.ndarray:
+    """Choose (at most) per_group of n rows for a state, chamber, and ensemble combination, reproducibly."""
+
+    combo: int = zlib.crc32("/".join(key).encode("utf-8"))
+    rng: np.random.Generator = np.random.default_rng([seed, combo])
+    rows: np.ndarray = np.sort(rng.choice(n, size=min(per_group, n), replace=False))
+
+    return rows
+
+
+def _count_type(values: np.ndarray, otherwise: Any) -> np.dtype:
+    """The smallest int type that holds values that are all whole numbers, or the 'otherwise' type if they aren't."""
+
+    if (
+        values.size > 0
+        and np.all(np.isfinite(values))
+        and np.all(values == np.round(values))
+    ):
+        for int_type in [np.int8, np.int16, np.int32, np.int64]:
+            info: np.iinfo = np.iinfo(int_type)
+            if values.min() >= info.min and values.max() <= info.max:
+                return np.dtype(int_type)
+
+    return np.dtype(otherwise)
+
+
+def _decode_bytes(data: Buffer) -> List[Dict[str, Any]]:
+    """Decode the bytes (or a view of them) from a zipped by-district JSONL file."""
+
+    json_objects = [loads(line) for line in iter_lines(data) if not is_blank(line)]
 
     return json_objects
 
 
+def _iter_records(name: str, data: Buffer) -> Generator[Dict[str, Any], None, None]:
+    """Decompress & decode the records of a by-district JSONL file, one at a time."""
+
+    for line in iter_decompressed_lines(name, data):
+        if not is_blank(line):
+            yield loads(line)
+
+
+def _iter_by_district(
+    name: str, data: Buffer
+) -> Generator[Tuple[str, Any, Optional[ByDistrict]], None, None]:
+    """Decompress & decode just the tags, plan names, and by-district aggregates of a by-district JSONL file."""
+
+    for line in iter_decompressed_lines(name, data):
+        if not is_blank(line):
+            yield decode_by_district(line)
+
+
 def _extract_aggregates(
     data, category: str, minority_dataset: str = "vap"
 ) -> List[Dict[str, Any]]:
@@ -174,35 +572,242 @@ def _extract_aggregates(
     aggregates: List[Dict[str, Any]] = list()
 
     for record in data:
-        assert "_tag_" in record, "Record does not contain '_tag_' key"
+        collected_aggregates: Optional[Dict[str, Any]] = _collect_aggregates(
+            record, category, minority_dataset
+        )
+        if collected_aggregates is not None:
+            aggregates.append(collected_aggregates)
 
-        if record["_tag_"] == "metadata":
-            continue
+    return aggregates
 
-        assert (
-            record["_tag_"] == "by-district"
-        ), f"Record does not contain '_tag_' key with value 'by-district': {record}"
 
-        collected_aggregates: Dict[str, Any] = dict()
-        collected_aggregates["name"] = record["name"]
+def _collect_aggregates(
+    record: Dict[str, Any], category: str, minority_dataset: str = "vap"
+) -> Optional[Dict[str, Any]]:
+    """The name & by-district aggregates of a plan record. None for the metadata record."""
 
-        dataset: str = (
+    assert "_tag_" in record, "Record does not contain '_tag_' key"
+
+    if record["_tag_"] == "metadata":
+        return None
+
+    assert (
+        record["_tag_"] == "by-district"
+    ), f"Record does not contain '_tag_' key with value 'by-district': {record}"
+
+    collected_aggregates: Dict[str, Any] = dict()
+    collected_aggregates["name"] = record["name"]
+
+    dataset: str = (
+        datasets_by_aggregate_category[category][0]
+        if category != "minority"
+        else minority_dataset  # VAP or CVAP
+    )
+
+    # Skip over the dataset type and dataset name
+    aggs_list: List[Dict[str, List[Any]]] = record["by-district"][dataset].values()
+    # Make the aggregates a single dictionary again
+    aggs_dict: Dict[str, List[Any]] = {
+        k: v for agg in aggs_list for k, v in agg.items()
+    }
+    collected_aggregates.update(aggs_dict)
+
+    return collected_aggregates
+
+
+def _tee_aggregates(
+    data, category: str, minority_dataset: str, collected: List[Dict[str, Any]]
+) -> Generator[Tuple[str, Any, Optional[ByDistrict]], None, None]:
+    """
+    Pass the records on as decode_by_district does, for _extract_aggregate_arrays, collecting
+    their aggregates as _extract_aggregates does on the way: both, from one pass.
+    """
+
+    for record in data:
+        collected_aggregates: Optional[Dict[str, Any]] = _collect_aggregates(
+            record, category, minority_dataset
+        )
+        if collected_aggregates is not None:
+            collected.append(collected_aggregates)
+
+        yield record["_tag_"], record.get("name"), record.get("by-district")
+
+
+def _cached_records(
+    catalog: Catalog, aggs_file: ZipMember, category: str, minority_dataset: str
+) -> List[Dict[str, Any]]:
+    """
+    The records for a by-district file (see _extract_aggregates) through the cache: rebuilt from the
+    cached arrays, if they give back exactly the same records, else cached as they are. On a miss,
+    the arrays & the records are decoded in one pass.
+    """
+
+    variant: str = f"{category}/{minority_dataset}"
+    cached: Optional[Dict[str, np.ndarray]] = load_cached_arrays(aggs_file, category)
+    if cached is not None and cached["exact_records"]:
+        return _records_from_arrays(cached, category, minority_dataset)
+    if cached is not None:
+        cached_records: Optional[bytes] = load_cached_bytes(aggs_file, variant)
+        if cached_records is not None:
+            return loads(cached_records)
+
+    records: List[Dict[str, Any]] = list()
+    if cached is None:
+        extracted: Dict[str, np.ndarray]
+        extracted, exact = _extract_aggregate_arrays(
+            _tee_aggregates(
+                _iter_records(aggs_file.name, catalog.buffer(aggs_file)),
+                category,
+                minority_dataset,
+                records,
+            ),
+            category,
+            aggregates_by_category[category],
+        )
+        extracted["exact_records"] = np.array(exact)
+        save_cached_arrays(aggs_file, extracted, category)
+        if exact:
+            return records
+    else:
+        records = _extract_aggregates(
+            _iter_records(aggs_file.name, catalog.buffer(aggs_file)),
+            category,
+            minority_dataset,
+        )
+
+    save_cached_bytes(aggs_file, dumps(records), variant)
+
+    return records
+
+
+def _cached_aggregate_arrays(
+    catalog: Catalog, aggs_file: ZipMember, category: str
+) -> Dict[str, np.ndarray]:
+    """
+    All the aggregates in a by-district file, as arrays, from the cache or decoded & cached,
+    and whether the records can be rebuilt from them exactly ("exact_records").
+    """
+
+    cached: Optional[Dict[str, np.ndarray]] = load_cached_arrays(aggs_file, category)
+    if cached is not None:
+        return cached
+
+    extracted: Dict[str, np.ndarray]
+    extracted, exact = _extract_aggregate_arrays(
+        _iter_by_district(aggs_file.name, catalog.buffer(aggs_file)),
+        category,
+        aggregates_by_category[category],
+    )
+    extracted["exact_records"] = np.array(exact)
+    save_cached_arrays(aggs_file, extracted, category)
+
+    return extracted
+
+
+def _records_from_arrays(
+    arrays: Dict[str, np.ndarray], category: str, minority_dataset: str = "vap"
+) -> List[Dict[str, Any]]:
+    """Turn aggregate arrays back into the records _extract_aggregates makes, a plan at a time."""
+
+    selected: List[str] = [
+        agg
+        for agg in aggregates_by_category[category]
+        if category != "minority" or agg.rsplit("_", 1)[1] == minority_dataset
+    ]
+    columns: Dict[str, List[Any]] = {agg: arrays[agg].tolist() for agg in selected}
+
+    return [
+        {"name": name, **{agg: columns[agg][i] for agg in selected}}
+        for i, name in enumerate(arrays["name"].tolist())
+    ]
+
+
+def _extract_aggregate_arrays(
+    data, category: str, aggregates: List[str]
+) -> Tuple[Dict[str, np.ndarray], bool]:
+    """
+    Extract just the given by-district aggregates from the decoded records (see decode_by_district), into preallocated 2D plans x districts
+    arrays, along with the plan "name"s. Each aggregate's dtype is int64, or float64 if any of its values
+    are floats (like np.array of the records' lists). Ignore dataset names. Assume one dataset per type.
+    Also returns whether _records_from_arrays can rebuild the records _extract_aggregates makes exactly:
+    the plans have string names and just these aggregates, in this order, each all ints or all floats.
+    """
+
+    datasets: Dict[str, str] = {
+        agg: (
             datasets_by_aggregate_category[category][0]
             if category != "minority"
-            else minority_dataset  # VAP or CVAP
+            else agg.rsplit("_", 1)[1]  # VAP or CVAP
         )
+        for agg in aggregates
+    }
+    keys_by_dataset: Dict[str, List[str]] = {
+        dataset: [agg for agg in aggregates if datasets[agg] == dataset]
+        for dataset in set(datasets.values())
+    }
+
+    names: List[str] = list()
+    arrays: Dict[str, np.ndarray] = dict()
+    types: Dict[str, Set[type]] = {agg: set() for agg in aggregates}
+    exact: bool = True
+    n: int = 0
+
+    for tag, name, by_district in data:
+        if tag == "metadata":
+            continue
 
-        # Skip over the dataset type and dataset name
-        aggs_list: List[Dict[str, List[Any]]] = record["by-district"][dataset].values()
-        # Make the aggregates a single dictionary again
-        aggs_dict: Dict[str, List[Any]] = {
-            k: v for agg in aggs_list for k, v in agg.items()
-        }
-        collected_aggregates.update(aggs_dict)
+        assert (
+            tag == "by-district" and by_district is not None
+        ), f"Record does not contain '_tag_' key with value 'by-district': {name}"
 
-        aggregates.append(collected_aggregates)
+        if exact:
+            exact = isinstance(name, str) and all(
+                [k for aggs in by_district[dataset].values() for k in aggs] == keys
+                for dataset, keys in keys_by_dataset.items()
+            )
 
-    return aggregates
+        for agg in aggregates:
+            values: Optional[List[Any]] = next(
+                (
+                    aggs[agg]
+                    for aggs in by_district[datasets[agg]].values()
+                    if agg in aggs
+                ),
+                None,
+            )
+            assert values is not None, f"Aggregate {agg} not found in {name}"
+
+            # Size the arrays for a full ensemble, from the first plan, and grow them if need be.
+            # An aggregate is int64 until it has a float, then float64, with the ints already in it cast.
+
+            row_types: Set[type] = set(map(type, values))
+            types[agg] |= row_types
+            if agg not in arrays:
+                dtype: type = np.float64 if float in row_types else np.int64
+                arrays[agg] = np.empty((plans_per_ensemble, len(values)), dtype=dtype)
+            elif float in row_types and arrays[agg].dtype == np.int64:
+                arrays[agg] = arrays[agg].astype(np.float64)
+            if n == len(arrays[agg]):
+                arrays[agg] = np.concatenate([arrays[agg], np.empty_like(arrays[agg])])
+
+            arrays[agg][n] = values
+
+        names.append(name)
+        n += 1
+
+    # No plans: empty arrays for all the aggregates
+    for agg in aggregates:
+        arrays.setdefault(agg, np.empty((0, 0), dtype=np.int64))
+
+    extracted: Dict[str, np.ndarray] = {
+        agg: arr[:n].copy() if n < len(arr) else arr for agg, arr in arrays.items()
+    }
+    extracted["name"] = np.array(names)
+    exact = exact and all(
+        types[agg] <= {int} or types[agg] <= {float} for agg in aggregates
+    )
+
+    return extracted, exact
 
 
 ### END ###
@@ -0,0 +1,294 @@
+"""
+INDEXES FOR FAST STATE, CHAMBER, AND ENSEMBLE LOOKUPS IN THE SCORES
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import os
+from abc import ABC, abstractmethod
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .constants import scores_keys
+
+Key = Tuple[str, str, str]
+
+
+class _KeyedScores(ABC):
+    """Scores whose rows are grouped contiguously by state, chamber, and ensemble."""
+
+    slices: Dict[Key, slice]
+
+    def __len__(self) -> int:
+        return sum(s.stop - s.start for s in self.slices.values())
+
+    def keys(self) -> List[Key]:
+        """The state, chamber, and ensemble combinations in the scores."""
+
+        return list(self.slices.keys())
+
+    def rows(self, xx: str, chamber: str, ensemble: str) -> slice:
+        """The rows for a state, chamber, and ensemble combination (empty if not present)."""
+
+        return self.slices.get((xx, chamber, ensemble), slice(0, 0))
+
+    @abstractmethod
+    def column(self, metric: str) -> np.ndarray:
+        """A metric for all plans, as a numpy array."""
+
+    def array(self, xx: str, chamber: str, ensemble: str, metric: str) -> np.ndarray:
+        """A metric for a state, chamber, and ensemble combination, as a numpy array (a view)."""
+
+        return self.column(metric)[self.rows(xx, chamber, ensemble)]
+
+
+class ScoresIndex(_KeyedScores):
+    """
+    A scores DataFrame indexed by state, chamber, and ensemble.
+
+    The (state, chamber, ensemble) -> contiguous row slice mapping is computed once,
+    so subsetting a combination is an O(1) slice that returns a view instead of
+    building boolean masks over the whole frame and copying the result.
+    If the rows for a combination are not contiguous, the scores are (stably) sorted first.
+    """
+
+    def __init__(self, scores: pd.DataFrame) -> None:
+        slices: Optional[Dict[Key, slice]] = _group_slices(scores)
+        if slices is None:
+            scores = scores.sort_values(by=scores_keys, kind="stable").reset_index(
+                drop=True
+            )
+            slices = _group_slices(scores)
+            assert slices is not None, "Sorted scores are not grouped contiguously"
+
+        self.df: pd.DataFrame = scores
+        self.slices: Dict[Key, slice] = slices
+        self._columns: Dict[str, np.ndarray] = dict()
+
+    def frame(self, xx: str, chamber: str, ensemble: str) -> pd.DataFrame:
+        """The scores for a state, chamber, and ensemble combination."""
+
+        return self.df.iloc[self.rows(xx, chamber, ensemble)]
+
+    def column(self, metric: str) -> np.ndarray:
+        """A metric for all plans, as a numpy array (cached)."""
+
+        if metric not in self._columns:
+            self._columns[metric] = self.df[metric].to_numpy()
+
+        return self._columns[metric]
+
+
+class LazyScores(_KeyedScores):
+    """
+    A lazy, column-on-demand view of a scores .parquet file.
+
+    Opening it only reads the parquet metadata: for a file written by make_scores_df.py
+    (one row group per state, chamber, and ensemble), the row slice for each combination
+    comes from the row group statistics. Otherwise, just the state, chamber, and ensemble
+    columns are read. Each metric is read the first time it is accessed and then cached.
+    """
+
+    def __init__(self, scores_path: str) -> None:
+        self.path: str = os.path.expanduser(scores_path)
+        self.file: pq.ParquetFile = pq.ParquetFile(self.path)
+
+        # If the rows aren't grouped by combination, keep the order that groups them.
+        self._order: Optional[np.ndarray] = None
+
+        slices: Optional[Dict[Key, slice]] = _row_group_slices(self.file)
+        if slices is None:
+            keys: pd.DataFrame = self.file.read(columns=scores_keys).to_pandas()
+            slices = _group_slices(keys)
+            if slices is None:
+                self._order = keys.sort_values(
+                    by=scores_keys, kind="stable"
+                ).index.to_numpy()
+                slices = _group_slices(keys.iloc[self._order].reset_index(drop=True))
+                assert slices is not None, "Sorted scores are not grouped contiguously"
+
+        self.slices: Dict[Key, slice] = slices
+        self._columns: Dict[str, np.ndarray] = dict()
+
+    def frame(self, xx: str, chamber: str, ensemble: str) -> pd.DataFrame:
+        """The scores for a state, chamber, and ensemble combination (read from the file)."""
+
+        df: pd.DataFrame = pd.read_parquet(
+            self.path,
+            filters=[
+                (k, "==", v) for k, v in zip(scores_keys, [xx, chamber, ensemble])
+            ],
+        )
+
+        return df
+
+    def column(self, metric: str) -> np.ndarray:
+        """A metric for all plans, as a numpy array (read on first access, then cached)."""
+
+        if metric not in self._columns:
+            values: np.ndarray = self.file.read(columns=[metric]).column(0).to_numpy()
+            if self._order is not None:
+                values = values[self._order]
+            self._columns[metric] = values
+
+        return self._columns[metric]
+
+
+class ArrowScores(_KeyedScores):
+    """
+    Scores kept as a pyarrow Table sorted by state, chamber, and ensemble.
+
+    The metric array for a combination is a zero-copy numpy view of the slice of the
+    table's column buffer, so pulling every metric for every combination doesn't
+    allocate. A column is only copied once, the first time it's accessed, if it has
+    nulls (which become NaN) or if a combination spans two of its chunks.
+    """
+
+    def __init__(self, table: pa.Table) -> None:
+        keys: pd.DataFrame = table.select(scores_keys).to_pandas()
+        slices: Optional[Dict[Key, slice]] = _group_slices(keys)
+        if slices is None:
+            table = table.sort_by([(k, "ascending") for k in scores_keys])
+            slices = _group_slices(table.select(scores_keys).to_pandas())
+            assert slices is not None, "Sorted scores are not grouped contiguously"
+
+        self.table: pa.Table = table
+        self.slices: Dict[Key, slice] = slices
+        self._columns: Dict[str, pa.ChunkedArray] = dict()
+
+    def frame(self, xx: str, chamber: str, ensemble: str) -> pd.DataFrame:
+        """The scores for a state, chamber, and ensemble combination."""
+
+        rows: slice = self.rows(xx, chamber, ensemble)
+
+        return self.table.slice(rows.start, rows.stop - rows.start).to_pandas()
+
+    def column(self, metric: str) -> np.ndarray:
+        """A metric for all plans, as a numpy array."""
+
+        return self._column(metric).to_numpy()
+
+    def array(self, xx: str, chamber: str, ensemble: str, metric: str) -> np.ndarray:
+        """A metric for a state, chamber, and ensemble combination, as a zero-copy numpy view."""
+
+        rows: slice = self.rows(xx, chamber, ensemble)
+        values: pa.ChunkedArray = self._column(metric).slice(
+            rows.start, rows.stop - rows.start
+        )
+        chunks: List[pa.Array] = [c for c in values.chunks if len(c) > 0]
+        if not chunks:
+            return np.empty(0, dtype=values.type.to_pandas_dtype())
+        assert len(chunks) == 1, f"Scores for {xx}, {chamber}, {ensemble} span chunks"
+
+        return chunks[0].to_numpy(zero_copy_only=True)
+
+    def _column(self, metric: str) -> pa.ChunkedArray:
+        """A metric column with no nulls and no combination spanning chunks (prepared on first access)."""
+
+        if metric not in self._columns:
+            values: pa.ChunkedArray = self.table.column(metric)
+
+            if values.null_count > 0:
+                if not pa.types.is_floating(values.type):
+                    values = values.cast(pa.float64())
+                values = pc.fill_null(values, np.nan)
+
+            bounds: np.ndarray = np.cumsum([len(c) for c in values.chunks])[:-1]
+            for rows in self.slices.values():
+                i: int = int(np.searchsorted(bounds, rows.start, side="right"))
+                if i < len(bounds) and bounds[i] < rows.stop:
+                    values = pa.chunked_array([values.combine_chunks()])
+                    break
+
+            self._columns[metric] = values
+
+        return self._columns[metric]
+
+
+### HELPERS ###
+
+
+def _row_group_keys(file: pq.ParquetFile) -> Optional[List[Key]]:
+    """
+    Get the state, chamber, and ensemble of each row group from the row group statistics,
+    or None if any row group has more than one combination (or no statistics).
+    """
+
+    metadata: pq.FileMetaData = file.metadata
+    columns: Dict[str, int] = {
+        metadata.schema.column(i).name: i for i in range(metadata.num_columns)
+    }
+    if any(k not in columns for k in scores_keys):
+        return None
+
+    row_group_keys: List[Key] = list()
+    for i in range(metadata.num_row_groups):
+        key: List[str] = list()
+        for k in scores_keys:
+            stats = metadata.row_group(i).column(columns[k]).statistics
+            if stats is None or not stats.has_min_max or stats.min != stats.max:
+                return None
+            value = stats.min
+            key.append(value.decode("utf-8") if isinstance(value, bytes) else value)
+        row_group_keys.append((key[0], key[1], key[2]))
+
+    return row_group_keys
+
+
+def _row_group_slices(file: pq.ParquetFile) -> Optional[Dict[Key, slice]]:
+    """Map each state, chamber, and ensemble to its row slice using just the parquet metadata, if possible."""
+
+    row_group_keys: Optional[List[Key]] = _row_group_keys(file)
+    if row_group_keys is None:
+        return None
+
+    slices: Dict[Key, slice] = dict()
+    start: int = 0
+    previous: Optional[Key] = None
+    for i, key in enumerate(row_group_keys):
+        stop: int = start + file.metadata.row_group(i).num_rows
+        if key == previous:
+            slices[key] = slice(slices[key].start, stop)
+        elif key in slices:
+            return None
+        else:
+            slices[key] = slice(start, stop)
+        start = stop
+        previous = key
+
+    return slices
+
+
+def _key_runs(keys: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """The start and stop rows of each run of rows with the same state, chamber, and ensemble."""
+
+    starts: np.ndarray = np.flatnonzero((keys != keys.shift()).any(axis=1).to_numpy())
+    stops: np.ndarray = np.append(starts[1:], len(keys))
+
+    return starts, stops
+
+
+def _group_slices(df: pd.DataFrame) -> Optional[Dict[Key, slice]]:
+    """Map each state, chamber, and ensemble to its row slice, or None if the rows for a combination are not contiguous."""
+
+    if len(df) == 0:
+        return dict()
+
+    keys: pd.DataFrame = df[scores_keys]
+    starts, stops = _key_runs(keys)
+
+    slices: Dict[Key, slice] = dict()
+    for start, stop, key in zip(
+        starts, stops, keys.iloc[starts].itertuples(index=False, name=None)
+    ):
+        if key in slices:
+            return None
+        slices[key] = slice(int(start), int(stop))
+
+    return slices
+
+
+### END ###
@@ -0,0 +1,120 @@
+"""
+SQL QUERIES OVER THE SCORES & AGGREGATES
+
+An optional, embedded in-process SQL engine (DuckDB) over scores.parquet and the
+collected by-district aggregates. Queries are vectorized, use all cores, and push
+predicates and column projections down into the files. For example:
+
+    from rdametrics.query import query
+
+    df = query(
+        "SELECT state, chamber, ensemble, avg(fptp_seats) AS mean_D_seats "
+        "FROM scores GROUP BY state, chamber, ensemble",
+        scores_path="~/local/beta-ensembles/prepackaged/scores/scores.parquet",
+    )
+
+This module is not imported by the package. To use it:
+    `pip install duckdb`
+"""
+
+from typing import Optional
+
+import os
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError as e:
+    raise ImportError("rdametrics.query requires DuckDB: pip install duckdb") from e
+
+
+def connect(
+    scores_path: Optional[str] = None,
+    *,
+    aggregates_path: Optional[str] = None,
+    threads: Optional[int] = None,
+) -> duckdb.DuckDBPyConnection:
+    """
+    Open an in-memory DuckDB connection with the scores registered as the 'scores' view
+    and, optionally, the collected aggregates registered as the 'aggregates' view.
+    By default, DuckDB uses all cores.
+    """
+
+    con: duckdb.DuckDBPyConnection = duckdb.connect(":memory:")
+    if threads is not None:
+        con.execute(f"SET threads = {int(threads)}")
+
+    if scores_path is not None:
+        register_scores(con, scores_path)
+    if aggregates_path is not None:
+        register_aggregates(con, aggregates_path)
+
+    return con
+
+
+def register_scores(
+    con: duckdb.DuckDBPyConnection, scores_path: str, *, name: str = "scores"
+) -> None:
+    """Register a scores .parquet file (see data-scripts/make_scores_df.py) as a view."""
+
+    con.execute(
+        f"CREATE OR REPLACE VIEW {_quote_name(name)} AS SELECT * FROM read_parquet({_quote(scores_path)})"
+    )
+
+
+def register_aggregates(
+    con: duckdb.DuckDBPyConnection, aggregates_path: str, *, name: str = "aggregates"
+) -> None:
+    """
+    Register converted by-district aggregates as a view: either a .parquet file or
+    the JSONL file from data-scripts/collect_all_aggregates.py (one record per plan with
+    'state', 'chamber', 'ensemble', 'name', and an 'aggregates' struct of lists).
+    """
+
+    reader: str = (
+        f"read_parquet({_quote(aggregates_path)})"
+        if aggregates_path.endswith(".parquet")
+        else f"read_json({_quote(aggregates_path)}, format = 'newline_delimited')"
+    )
+    con.execute(f"CREATE OR REPLACE VIEW {_quote_name(name)} AS SELECT * FROM {reader}")
+
+
+def query(
+    sql: str,
+    *,
+    scores_path: Optional[str] = None,
+    aggregates_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """Run a SQL query over the scores and/or aggregates, and return the result as a DataFrame."""
+
+    con: duckdb.DuckDBPyConnection = connect(
+        scores_path, aggregates_path=aggregates_path
+    )
+    try:
+        df: pd.DataFrame = con.sql(sql).df()
+    finally:
+        con.close()
+
+    return df
+
+
+### HELPERS ###
+
+
+def _quote(path: str) -> str:
+    """Quote a file path as a SQL string literal."""
+
+    escaped: str = os.path.expanduser(path).replace("'", "''")
+
+    return f"'{escaped}'"
+
+
+def _quote_name(name: str) -> str:
+    """Quote a view name as a SQL identifier, so it can have spaces or be a reserved word."""
+
+    escaped: str = name.replace('"', '""')
+
+    return f'"{escaped}"'
+
+
+### END ###
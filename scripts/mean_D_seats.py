@@ -7,16 +7,17 @@ DEM SEATS BY STATE/CHAMBER COMBO AND ENSEMBLE TYPE
 
 from typing import List, Dict
 
-import os
-import pandas as pd
+import numpy as np
 
 from rdapy import DISTRICTS_BY_STATE
 from rdametrics import states, chambers, ensembles
+from data import LazyScores, arr_from_scores
 
 
 scores_path: str = "~/local/beta-ensembles/dataframe/contents/scores_df.parquet"
 
-df = pd.read_parquet(os.path.expanduser(scores_path))
+# Only the 'fptp_seats' column is read from the file
+scores = LazyScores(scores_path)
 
 table_6: List[str] = [e for e in ensembles if e not in ["A2", "A3", "A4", "Rev*"]]
 
@@ -30,13 +31,9 @@ for xx in states:
         d_seats[combo] = dict()
 
         for ensemble in table_6:
-            mean_seats = df[
-                (df["state"] == xx)
-                & (df["chamber"] == chamber)
-                & (df["ensemble"] == ensemble)
-            ][
-                "fptp_seats"
-            ].mean()  # "Dem seats" is 'fptp_seats' in the dataframe
+            mean_seats = np.nanmean(
+                arr_from_scores(xx, chamber, ensemble, "fptp_seats", scores)
+            )  # "Dem seats" is 'fptp_seats' in the dataframe
             d_seats[combo][ensemble] = float(mean_seats)
 
 header: str = ",".join(v for v in table_6)